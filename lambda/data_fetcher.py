@@ -2,11 +2,16 @@ import json
 import logging
 import sys
 import requests
-import io
+import gzip
+import numpy as np
 import pandas as pd
 import datetime
 import boto3
 from decouple import config
+from data_quality import validate_users
+from lake_storage import S3Storage, to_parquet_bytes
+from manifest import append_entry, build_entry
+from rollups import close_day, update_rollups
 
 # Configure logging (compatible with Lambda and local testing)
 logger = logging.getLogger()
@@ -15,6 +20,27 @@ logger.setLevel(logging.INFO)
 # Initialize S3 client
 s3 = boto3.client('s3')
 
+# Raw API payloads are stored gzip-compressed next to the curated Parquet output
+RAW_PAYLOAD_EXTENSION = ".json.gz"
+
+# Records failing data-quality rules are stored as gzip-compressed JSON Lines
+QUARANTINE_EXTENSION = ".jsonl.gz"
+
+# Identifiers that look numeric for some countries only (e.g. "EC1A 1BB" in GB)
+STRING_COLUMNS = ['location.postcode']
+
+# Typed output mode (TYPED_OUTPUT=true): physical types of the Parquet columns.
+# Integer widths are bounded by the data-quality rules (ages 0-120, street numbers
+# 0-32767). Keep the Glue schemas in mps_catalog_stack.py consistent with these.
+TYPED_TIMESTAMP_COLUMNS = ['dob.date', 'registered.date']
+TYPED_NUMERIC_COLUMNS = {
+    'dob.age': 'int8',
+    'registered.age': 'int8',
+    'location.street.number': 'int16',
+    'location.coordinates.latitude': 'float32',
+    'location.coordinates.longitude': 'float32',
+}
+
 # Only add handler if not already present (Lambda adds its own)
 if not logger.handlers:
     handler = logging.StreamHandler(sys.stdout)
@@ -23,139 +49,533 @@ if not logger.handlers:
     logger.addHandler(handler)
 
 
+def build_partition_key(prefix, now, file_id, extension):
+    """
+    Build an S3 key with Hive-style partitioning.
+
+    Args:
+        prefix: Base storage prefix (e.g. raw/users)
+        now: Datetime used for the year/month/day partition values
+        file_id: File name without extension (the Lambda execution ID)
+        extension: File extension including the leading dot
+
+    Returns:
+        S3 key in the form prefix/year=YYYY/month=MM/day=DD/file_id.extension
+    """
+    return (
+        f"{prefix}/"
+        f"year={now.year}/"
+        f"month={now.month:02}/"
+        f"day={now.day:02}/"
+        f"{file_id}{extension}"
+    )
+
+
+def raw_key_to_partition_key(raw_key, raw_prefix, target_prefix, extension=".parquet"):
+    """
+    Map a stored raw payload key to the key of a file derived from it.
+
+    Args:
+        raw_key: S3 key of the compressed raw JSON payload
+        raw_prefix: Prefix under which raw payloads are stored
+        target_prefix: Prefix of the derived file (e.g. FILEPATH_BASE_STORAGE)
+        extension: Extension of the derived file including the leading dot
+
+    Returns:
+        S3 key under target_prefix with the same partitions and file name
+
+    Raises:
+        ValueError: If the key is not a raw payload key under raw_prefix
+    """
+    prefix = f"{raw_prefix}/"
+    if not raw_key.startswith(prefix) or not raw_key.endswith(RAW_PAYLOAD_EXTENSION):
+        raise ValueError(f"Not a raw payload key under '{raw_prefix}': {raw_key}")
+
+    partition_path = raw_key[len(prefix):-len(RAW_PAYLOAD_EXTENSION)]
+    return f"{target_prefix}/{partition_path}{extension}"
+
+
+def save_raw_payload(payload, bucket_name, raw_key):
+    """
+    Persist the raw API response body gzip-compressed in S3.
+
+    Args:
+        payload: Raw response body as bytes
+        bucket_name: Target S3 bucket
+        raw_key: Target S3 key
+    """
+    s3.put_object(
+        Bucket=bucket_name,
+        Key=raw_key,
+        Body=gzip.compress(payload),
+        ContentType="application/json",
+        ContentEncoding="gzip",
+    )
+    logger.info(f"Raw payload uploaded to S3: {bucket_name}/{raw_key}")
+
+
+def load_raw_payload(bucket_name, raw_key):
+    """
+    Read and decompress a raw API response previously stored by save_raw_payload.
+
+    Args:
+        bucket_name: Source S3 bucket
+        raw_key: Source S3 key
+
+    Returns:
+        Tuple (decoded JSON payload, timezone-aware datetime the payload was stored)
+    """
+    obj = s3.get_object(Bucket=bucket_name, Key=raw_key)
+    return decode_raw_payload(obj["Body"].read()), obj["LastModified"]
+
+
+def decode_raw_payload(body):
+    """
+    Decompress and parse a raw API payload as stored by save_raw_payload.
+
+    Args:
+        body: Compressed payload bytes
+
+    Returns:
+        Decoded JSON payload
+    """
+    return json.loads(gzip.decompress(body))
+
+
+def normalize_users(data_users):
+    """
+    Flatten the API user records into a DataFrame.
+
+    Args:
+        data_users: List of user records from the API `results` array
+
+    Returns:
+        DataFrame with one dotted column per nested field, values untouched
+    """
+    df = pd.json_normalize(data_users)
+    logger.info("Listing columns with their respective data types")
+    logger.info(df.dtypes)
+    return df
+
+
+def cast_columns(df, typed=False):
+    """
+    Cast a normalized user DataFrame to the types written to Parquet.
+
+    Args:
+        df: Normalized user DataFrame
+        typed: Use the compact typed output (timestamps, narrowed integers and float
+            coordinates)
+
+    Returns:
+        DataFrame with numeric columns kept numeric and object columns as strings
+    """
+    # Clean up data types: keep numeric types and convert only object columns to string
+    logger.info("Cleaning data types for Parquet conversion...")
+
+    # Columns that should remain as numeric types
+    numeric_columns = {
+        'location.street.number': 'int64',
+        'dob.age': 'int64',
+        'registered.age': 'int64',
+    }
+
+    for col in df.columns:
+        if typed and col in TYPED_TIMESTAMP_COLUMNS:
+            # Missing or malformed dates become null instead of the string "None"
+            df[col] = pd.to_datetime(df[col], errors='coerce', utc=True)
+            logger.info(f"Column '{col}' converted to timestamp")
+        elif typed and col in TYPED_NUMERIC_COLUMNS:
+            target_type = TYPED_NUMERIC_COLUMNS[col]
+            values = pd.to_numeric(df[col], errors='coerce')
+            if target_type.startswith('int'):
+                values = values.fillna(0)
+                bounds = np.iinfo(target_type)
+                if not values.between(bounds.min, bounds.max).all():
+                    raise ValueError(f"Column '{col}' has values outside the {target_type} range")
+            df[col] = values.astype(target_type)
+            logger.info(f"Column '{col}' narrowed to {target_type}")
+        elif col in STRING_COLUMNS:
+            # Always strings, even when every value in the batch happens to be numeric
+            df[col] = df[col].astype(str)
+            logger.info(f"Column '{col}' converted to string")
+        elif col in numeric_columns:
+            # Keep numeric columns as their type - convert None/NaN to 0
+            target_type = numeric_columns[col]
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(target_type)
+            logger.info(f"Column '{col}' kept as {target_type}")
+        elif df[col].dtype == 'object':
+            # Convert only object columns to string to handle mixed types
+            df[col] = df[col].astype(str)
+            logger.info(f"Column '{col}' converted to string")
+        else:
+            # Keep other numeric types as they are
+            logger.info(f"Column '{col}' kept as {df[col].dtype}")
+
+    return df
+
+
+def transform_users(data_users, typed=False):
+    """
+    Normalize, validate and cast the API user records.
+
+    Args:
+        data_users: List of user records from the API `results` array
+        typed: Use the compact typed output (see cast_columns)
+
+    Returns:
+        Tuple (df, quarantine_df): the curated rows ready for Parquet conversion and
+        the rows failing data-quality rules with their reason codes
+    """
+    df = normalize_users(data_users)
+
+    # ----------------- Data Validation -----------------
+    # Rules run before casting so malformed values are not hidden as 0 or "None"
+    df, quarantine_df = validate_users(df)
+    if len(quarantine_df):
+        logger.warning(f"{len(quarantine_df)} record(s) failed data-quality rules and were quarantined")
+
+    return cast_columns(df, typed=typed), quarantine_df
+
+
+def quarantine_to_bytes(quarantine_df):
+    """
+    Serialize quarantined rows as gzip-compressed JSON Lines, keeping original values.
+
+    Args:
+        quarantine_df: Rows failing data-quality rules
+
+    Returns:
+        Compressed JSON Lines bytes
+    """
+    return gzip.compress(quarantine_df.to_json(orient="records", lines=True).encode("utf-8"))
+
+
+def save_quarantine(quarantine_df, bucket_name, quarantine_key):
+    """
+    Write quarantined rows to S3 when there are any.
+
+    Args:
+        quarantine_df: Rows failing data-quality rules
+        bucket_name: Target S3 bucket
+        quarantine_key: Target S3 key
+    """
+    if quarantine_df.empty:
+        return
+
+    s3.put_object(
+        Bucket=bucket_name,
+        Key=quarantine_key,
+        Body=quarantine_to_bytes(quarantine_df),
+        ContentType="application/x-ndjson",
+        ContentEncoding="gzip",
+    )
+    logger.info(f"Quarantined records uploaded to S3: {bucket_name}/{quarantine_key}")
+
+
+def save_parquet(df, bucket_name, s3_key):
+    """
+    Write a DataFrame as Parquet to S3.
+
+    Args:
+        df: DataFrame to write
+        bucket_name: Target S3 bucket
+        s3_key: Target S3 key
+
+    Returns:
+        The Parquet bytes written
+    """
+    body = to_parquet_bytes(df)
+    s3.put_object(Bucket=bucket_name, Key=s3_key, Body=body)
+    logger.info(f"Parquet file uploaded to S3: {bucket_name}/{s3_key}")
+    return body
+
+
+def record_manifest_entry(df, body, bucket_name, s3_key, manifest_prefix, run_id):
+    """
+    Append a written Parquet file to the manifest index (see manifest.py).
+
+    Args:
+        df: DataFrame the file was written from
+        body: Parquet bytes as written
+        bucket_name: Data bucket
+        s3_key: Key of the Parquet file
+        manifest_prefix: Prefix under which manifest entries are stored
+        run_id: Run identifier used in the entry key
+    """
+    append_entry(S3Storage(bucket_name, client=s3), manifest_prefix, build_entry(s3_key, body, df), run_id)
+
+
+def replay(raw_keys, bucket_name, raw_prefix, filepath_base_storage, quarantine_prefix, typed=False,
+           manifest_prefix=None, output_format="parquet"):
+    """
+    Rebuild the curated output from stored raw payloads without calling the API.
+
+    With output_format "iceberg" each payload is committed to the Iceberg table as
+    the batch of the invocation that stored it, unless that batch is already in the
+    table, so replaying a payload never duplicates its rows.
+
+    Args:
+        raw_keys: S3 keys of the raw payloads to replay
+        bucket_name: Data bucket holding both raw payloads and Parquet output
+        raw_prefix: Prefix under which raw payloads are stored
+        filepath_base_storage: Prefix under which Parquet files are stored
+        quarantine_prefix: Prefix under which quarantined records are stored
+        typed: Use the compact typed output (see cast_columns)
+        manifest_prefix: Prefix of the manifest index; rebuilt files are recorded
+            as new entries when set
+        output_format: "parquet" or "iceberg", as OUTPUT_FORMAT
+
+    Returns:
+        Response with status code and body listing the rebuilt output
+    """
+    logger.info(f"Replaying {len(raw_keys)} raw payload(s)")
+
+    replayed = []
+    for raw_key in raw_keys:
+        s3_key = raw_key_to_partition_key(raw_key, raw_prefix, filepath_base_storage)
+        quarantine_key = raw_key_to_partition_key(raw_key, raw_prefix, quarantine_prefix, QUARANTINE_EXTENSION)
+        run_id = raw_key.rsplit("/", 1)[-1][:-len(RAW_PAYLOAD_EXTENSION)]
+        data, stored_at = load_raw_payload(bucket_name, raw_key)
+        data_users = data.get("results", [])
+
+        df, quarantine_df = transform_users(data_users, typed=typed)
+        output = {}
+        if output_format == "iceberg":
+            # Imported here so the Parquet path does not load the optional Iceberg dependency
+            import iceberg_sink
+            output["iceberg_snapshot_id"] = iceberg_sink.write_users(
+                df, stored_at.astimezone(datetime.timezone.utc), batch_id=run_id
+            )
+        else:
+            body = save_parquet(df, bucket_name, s3_key)
+            if manifest_prefix:
+                record_manifest_entry(df, body, bucket_name, s3_key, manifest_prefix, run_id)
+            output["s3_path"] = f"s3://{bucket_name}/{s3_key}"
+        save_quarantine(quarantine_df, bucket_name, quarantine_key)
+        replayed.append({
+            "raw_path": f"s3://{bucket_name}/{raw_key}",
+            **output,
+            "users_count": len(data_users),
+            "quarantined_count": len(quarantine_df),
+        })
+
+    return {
+        "statusCode": 200,
+        "body": json.dumps({
+            "message": "Raw payloads replayed to S3 successfully.",
+            "replayed": replayed,
+        }),
+    }
+
+
 def handler(event, context):
     """
     Lambda function handler to fetch data from an external API.
-    
+
+    Invoking with {"profile": true}, or setting PROFILE_HANDLER=true, records a CPU
+    profile and the top memory allocation sites of the invocation (see profiling.py).
+    Without either, the profiler is neither imported nor started.
+
+    The raw API response is stored gzip-compressed under FILEPATH_RAW_STORAGE before
+    being curated into Parquet. Records failing data-quality rules are written to
+    FILEPATH_QUARANTINE_STORAGE with their reason codes. With OUTPUT_FORMAT=iceberg the
+    curated rows are committed to the Iceberg table instead of a loose Parquet file.
+    Each batch is then aggregated into the daily rollups under FILEPATH_ROLLUPS_STORAGE.
+    Every Parquet file written is recorded in the manifest index under
+    FILEPATH_MANIFEST_STORAGE, so incremental consumers do not have to list partitions.
+    Invoking with {"mode": "replay", "raw_keys": [...]} rebuilds the curated output
+    (Parquet files or Iceberg commits, per OUTPUT_FORMAT) from those stored payloads
+    without any HTTP calls. Invoking with {"mode": "close_rollups"}, as the daily
+    schedule does, merges the rollup files of the previous day (or of "day", as
+    YYYY-MM-DD) into one file per rollup.
+
     Args:
         event: Lambda event data
         context: Lambda runtime context
-        
+
     Returns:
         Response with status code and body containing result or error message
-        
+
     Raises:
         Exception: On validation errors or processing failures
     """
-    logger.info("Starting data fetch from API")
-    
+    event = event or {}
+
+    if event.get("profile") or config("PROFILE_HANDLER", default=False, cast=bool):
+        import profiling  # Only loaded when a profile is requested
+
+        return profiling.run_profiled(process_event, event, context, s3)
+    return process_event(event, context)
+
+
+def process_event(event, context):
+    """
+    Fetch, curate and store one batch of users, replay stored payloads or close a rollup day.
+
+    Args:
+        event: Lambda event data
+        context: Lambda runtime context
+
+    Returns:
+        Response with status code and body containing result or error message
+    """
     try:
         api_url = config("API_URL", default=None)
         requests_timeout = int(config("REQUESTS_TIMEOUT", default="0"))
         bucket_name = config("BUCKET_NAME")
         filepath_base_storage = config("FILEPATH_BASE_STORAGE")
-        
+        filepath_raw_storage = config("FILEPATH_RAW_STORAGE", default="raw_json/users")
+        filepath_quarantine_storage = config("FILEPATH_QUARANTINE_STORAGE", default="quarantine/users")
+        output_format = config("OUTPUT_FORMAT", default="parquet")
+        filepath_rollups_storage = config("FILEPATH_ROLLUPS_STORAGE", default="rollups")
+        typed_output = config("TYPED_OUTPUT", default=False, cast=bool)
+        filepath_manifest_storage = config("FILEPATH_MANIFEST_STORAGE", default="manifests/users")
+
         # Validate configuration
-        if not api_url:
-            msg = "API_URL environment variable is not configured."
-            logger.error(msg)
-            raise ValueError(msg)
-        
-        if requests_timeout == 0:
-            msg = "REQUESTS_TIMEOUT environment variable is not configured."
-            logger.error(msg)
-            raise ValueError(msg)
-        
         if not bucket_name:
             msg = "BUCKET_NAME environment variable is not configured."
             logger.error(msg)
             raise ValueError(msg)
-        
+
         if not filepath_base_storage:
             msg = "FILEPATH_BASE_STORAGE environment variable is not configured."
             logger.error(msg)
             raise ValueError(msg)
-        
+
+        if output_format not in ("parquet", "iceberg"):
+            msg = f"OUTPUT_FORMAT must be 'parquet' or 'iceberg', got '{output_format}'."
+            logger.error(msg)
+            raise ValueError(msg)
+
+        # ----------------- Replay mode -----------------
+        if event.get("mode") == "replay":
+            raw_keys = event.get("raw_keys") or []
+            if not raw_keys:
+                msg = "Replay mode requires a non-empty 'raw_keys' list."
+                logger.error(msg)
+                raise ValueError(msg)
+
+            return replay(
+                raw_keys,
+                bucket_name,
+                filepath_raw_storage,
+                filepath_base_storage,
+                filepath_quarantine_storage,
+                typed=typed_output,
+                manifest_prefix=filepath_manifest_storage,
+                output_format=output_format,
+            )
+
+        # ----------------- Close-of-day rollups -----------------
+        if event.get("mode") == "close_rollups":
+            today = datetime.datetime.now(datetime.timezone.utc).date()
+            day = datetime.date.fromisoformat(event["day"]) if event.get("day") else today - datetime.timedelta(days=1)
+            if day >= today:
+                msg = f"Cannot close the rollups of {day}: the day is not finished."
+                logger.error(msg)
+                raise ValueError(msg)
+
+            merged_files = close_day(S3Storage(bucket_name, client=s3), filepath_rollups_storage, day)
+            return {
+                "statusCode": 200,
+                "body": json.dumps({
+                    "message": "Rollups closed successfully.",
+                    "day": day.isoformat(),
+                    "merged_files": merged_files,
+                }),
+            }
+
+        if not api_url:
+            msg = "API_URL environment variable is not configured."
+            logger.error(msg)
+            raise ValueError(msg)
+
+        if requests_timeout == 0:
+            msg = "REQUESTS_TIMEOUT environment variable is not configured."
+            logger.error(msg)
+            raise ValueError(msg)
+
         # ----------------- Data extraction -----------------
         #  Fetch data from the API
+        logger.info("Starting data fetch from API")
         logger.info(f"Fetching data from {api_url}")
-        
+
         response = requests.get(api_url, timeout=requests_timeout)
         response.raise_for_status()
-        data = response.json()        
+        data = response.json()
         logger.info("Data fetched successfully")
-        
+
         data_users = data.get("results", [])
         row_count = len(data_users)
         logger.info(f"Number of records fetched: {row_count}")
-        
+
+        # Define the S3 keys (paths) with Hive-style partitioning
+        # year=YYYY/month=MM/day=DD/file_UUID.<ext>
+        # Use the execution ID as the filename so raw and curated files share the same key
+        now = datetime.datetime.now()
+        raw_key = build_partition_key(filepath_raw_storage, now, context.aws_request_id, RAW_PAYLOAD_EXTENSION)
+        s3_key = build_partition_key(filepath_base_storage, now, context.aws_request_id, ".parquet")
+        quarantine_key = build_partition_key(
+            filepath_quarantine_storage, now, context.aws_request_id, QUARANTINE_EXTENSION
+        )
+
+        # Keep the untouched payload so the transform can be replayed later
+        save_raw_payload(response.content, bucket_name, raw_key)
+
         # ----------------- Data Transformation -----------------
         # Process data and write to Parquet
-        df = pd.json_normalize(data_users)
-        logger.info("Listing columns with their respective data types")
-        logger.info(df.dtypes)
-        
-        # Clean up data types: keep numeric types and convert only object columns to string
-        logger.info("Cleaning data types for Parquet conversion...")
-        
-        # Columns that should remain as numeric types
-        numeric_columns = {
-            'location.street.number': 'int64',
-            'location.postcode': 'int64',
-            'dob.age': 'int64',
-            'registered.age': 'int64',
-        }
-        
-        for col in df.columns:
-            if col in numeric_columns:
-                # Keep numeric columns as their type - convert None/NaN to 0
-                target_type = numeric_columns[col]
-                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(target_type)
-                logger.info(f"Column '{col}' kept as {target_type}")
-            elif df[col].dtype == 'object':
-                # Convert only object columns to string to handle mixed types
-                df[col] = df[col].astype(str)
-                logger.info(f"Column '{col}' converted to string")
-            else:
-                # Keep other numeric types as they are
-                logger.info(f"Column '{col}' kept as {df[col].dtype}")
-        
+        df, quarantine_df = transform_users(data_users, typed=typed_output)
+
         # ----------------- Data Loading -----------------
-        # Use BytesIO to write Parquet in memory before uploading to S3
-        parquet_buffer = io.BytesIO()
-        df.to_parquet(parquet_buffer, engine='pyarrow', index=False)
+        output = {}
+        if output_format == "iceberg":
+            # Imported here so the Parquet path does not load the optional Iceberg dependency
+            import iceberg_sink
+            output["iceberg_snapshot_id"] = iceberg_sink.write_users(
+                df, now.astimezone(datetime.timezone.utc), batch_id=context.aws_request_id
+            )
+        else:
+            body = save_parquet(df, bucket_name, s3_key)
+            record_manifest_entry(
+                df, body, bucket_name, s3_key, filepath_manifest_storage, context.aws_request_id
+            )
+            output["s3_path"] = f"s3://{bucket_name}/{s3_key}"
+        save_quarantine(quarantine_df, bucket_name, quarantine_key)
 
-        # Define the S3 key (path) with Hive-style partitioning
-        # year=YYYY/month=MM/day=DD/file_UUID.parquet
-        now = datetime.datetime.now()
-        s3_key = (
-            f"{filepath_base_storage}/"
-            f"year={now.year}/"
-            f"month={now.month:02}/"
-            f"day={now.day:02}/"
-            f"{context.aws_request_id}.parquet"  # Use the execution ID as the filename
+        # ----------------- Rollups -----------------
+        # Aggregate the batch into its own dashboard rollup files instead of recomputing history
+        update_rollups(
+            df, S3Storage(bucket_name, client=s3), filepath_rollups_storage, now, context.aws_request_id
         )
 
-        parquet_buffer.seek(0)
-        s3.put_object(Bucket=bucket_name, Key=s3_key, Body=parquet_buffer.getvalue())
-        logger.info(f"Parquet file uploaded to S3: {bucket_name}/{s3_key}")
-        
         return {
             "statusCode": 200,
             "body": json.dumps({
                 "message": "Data extracted and saved to S3 successfully.",
-                "s3_path": f"s3://{bucket_name}/{s3_key}",
-                "users_count": row_count
+                **output,
+                "raw_path": f"s3://{bucket_name}/{raw_key}",
+                "users_count": row_count,
+                "quarantined_count": len(quarantine_df),
             }),
         }
-    
+
     except requests.exceptions.Timeout as e:
         msg = "Request timeout while fetching data from API"
         logger.error(msg)
         raise TimeoutError(msg) from e
-    
+
     except requests.exceptions.RequestException as e:
         msg = f"Error fetching data from API: {str(e)}"
         logger.error(msg)
         raise RuntimeError(msg) from e
-    
+
     except json.JSONDecodeError as e:
         msg = f"Invalid JSON response from API: {str(e)}"
         logger.error(msg)
         raise ValueError(msg) from e
-    
+
     except Exception as e:
         msg = f"Unexpected error: {str(e)}"
         logger.error(msg, exc_info=True)
         raise Exception(msg)
-    
\ No newline at end of file
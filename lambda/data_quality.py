@@ -0,0 +1,90 @@
+"""
+Data-quality validation stage for user records.
+
+Rules run column-wise over the whole normalized batch (before any type coercion),
+so a malformed value is caught instead of being silently turned into 0 or "None".
+Rows failing at least one rule are split out together with their reason codes.
+"""
+import numpy as np
+import pandas as pd
+
+# Column holding the semicolon-separated reason codes of quarantined rows
+REASONS_COLUMN = "dq_reasons"
+
+EMAIL_PATTERN = r"[^@\s]+@[^@\s]+\.[^@\s]+"
+
+# Nationalities served by the Random User API
+VALID_NAT_CODES = {
+    "AU", "BR", "CA", "CH", "DE", "DK", "ES", "FI", "FR", "GB", "IE",
+    "IN", "IR", "MX", "NL", "NO", "NZ", "RS", "TR", "UA", "US",
+}
+
+# Inclusive (min, max) bounds for numeric columns. They also guarantee the values
+# fit the narrowed integer types of the typed Parquet output.
+NUMERIC_RANGES = {
+    "dob.age": (0, 120),
+    "registered.age": (0, 120),
+    "location.street.number": (0, 32767),
+}
+
+
+def _column(df, col):
+    """Return a column, or an all-null Series when the batch does not have it."""
+    if col in df.columns:
+        return df[col]
+    return pd.Series(pd.NA, index=df.index, dtype="object")
+
+
+def evaluate_rules(df):
+    """
+    Evaluate every rule over the batch.
+
+    Args:
+        df: Normalized (flattened, not yet type-cast) user DataFrame
+
+    Returns:
+        Dict mapping reason code to a boolean Series that is True where the row fails
+    """
+    failures = {}
+
+    email = _column(df, "email").astype("string")
+    failures["invalid_email"] = ~email.str.fullmatch(EMAIL_PATTERN).fillna(False).astype(bool)
+
+    for col, (low, high) in NUMERIC_RANGES.items():
+        values = pd.to_numeric(_column(df, col), errors="coerce")
+        code = f"invalid_{col.replace('.', '_')}"
+        failures[code] = ~values.between(low, high).fillna(False).astype(bool)
+
+    uuid = _column(df, "login.uuid").astype("string").str.strip()
+    failures["missing_login_uuid"] = (uuid.isna() | (uuid == "")).fillna(True).astype(bool)
+
+    failures["invalid_nat"] = ~_column(df, "nat").isin(VALID_NAT_CODES)
+
+    return failures
+
+
+def validate_users(df):
+    """
+    Split a batch into valid rows and quarantined rows.
+
+    Args:
+        df: Normalized (flattened, not yet type-cast) user DataFrame
+
+    Returns:
+        Tuple (valid_df, quarantine_df). quarantine_df holds the failing rows with
+        their original values plus a REASONS_COLUMN of semicolon-separated codes.
+    """
+    failures = evaluate_rules(df)
+
+    failed = np.zeros(len(df), dtype=bool)
+    reasons = np.full(len(df), "", dtype=object)
+    for code, mask in failures.items():
+        mask = mask.to_numpy(dtype=bool)
+        failed |= mask
+        reasons = np.where(mask, reasons + code + ";", reasons)
+
+    valid_df = df.loc[~failed].reset_index(drop=True)
+    quarantine_df = df.loc[failed].reset_index(drop=True)
+    quarantine_df[REASONS_COLUMN] = pd.Series(reasons[failed], dtype="object").str.rstrip(";")
+
+    return valid_df, quarantine_df
@@ -0,0 +1,208 @@
+"""
+Apache Iceberg sink for the curated users dataset.
+
+Each ingestion batch is committed to the table as one snapshot. Data files carry
+per-column lower/upper bounds in their manifests, so engines prune files on
+`ingested_at` (and other columns) without listing S3 prefixes. Rows also carry the
+`batch_id` of the invocation that fetched them, so a retried or replayed batch that
+is already in the table is not committed twice.
+
+The catalog is Glue in AWS (see CatalogStack) and a SQLite-backed SQL catalog
+for local runs and tests:
+
+    ICEBERG_CATALOG_TYPE=sql
+    ICEBERG_CATALOG_URI=sqlite:////tmp/mps/catalog.db
+    ICEBERG_WAREHOUSE=file:///tmp/mps/warehouse
+
+Its dependencies are listed in requirements-iceberg.txt, installed into the Lambda
+bundle only when the stack is deployed with ENABLE_ICEBERG.
+
+Compaction, snapshot expiry and orphan file deletion are run on the table by the
+Glue table optimizers of CatalogStack. For an on-demand run, use Athena:
+
+    OPTIMIZE "mps-data-db".mps_users_iceberg REWRITE DATA USING BIN_PACK
+    VACUUM "mps-data-db".mps_users_iceberg
+"""
+import logging
+
+import pyarrow as pa
+from decouple import config
+from pyiceberg.catalog import load_catalog
+from pyiceberg.exceptions import NoSuchTableError
+from pyiceberg.expressions import EqualTo
+from pyiceberg.io.pyarrow import schema_to_pyarrow
+
+logger = logging.getLogger(__name__)
+
+# Timestamp of the ingestion batch, added to every row. Its manifest bounds are kept
+# in full so time-range queries can skip files.
+INGESTED_AT_COLUMN = "ingested_at"
+
+# Request ID of the invocation that fetched the batch. Bounds are kept in full so
+# looking a batch up only opens the files that may hold it.
+BATCH_ID_COLUMN = "batch_id"
+
+TABLE_PROPERTIES = {
+    "format-version": "2",
+    "write.parquet.compression-codec": "zstd",
+    "write.metadata.metrics.default": "truncate(16)",
+    f"write.metadata.metrics.column.{INGESTED_AT_COLUMN}": "full",
+    f"write.metadata.metrics.column.{BATCH_ID_COLUMN}": "full",
+}
+
+
+def get_catalog():
+    """
+    Load the Iceberg catalog configured through environment variables.
+
+    Returns:
+        pyiceberg Catalog (Glue or SQL)
+    """
+    catalog_type = config("ICEBERG_CATALOG_TYPE", default="glue")
+    properties = {"type": catalog_type}
+
+    warehouse = config("ICEBERG_WAREHOUSE", default=None)
+    if warehouse:
+        properties["warehouse"] = warehouse
+
+    if catalog_type == "sql":
+        properties["uri"] = config("ICEBERG_CATALOG_URI")
+
+    return load_catalog("mps", **properties)
+
+
+def table_identifier():
+    """Return the (namespace, table) identifier of the users Iceberg table."""
+    return (
+        config("ICEBERG_NAMESPACE", default="mps-data-db"),
+        config("ICEBERG_TABLE", default="mps_users_iceberg"),
+    )
+
+
+def iceberg_compatible_type(arrow_type):
+    """
+    Map an Arrow type to the closest type Iceberg can store.
+
+    8/16-bit integers are stored as int and timestamps as microseconds without a
+    time zone (Iceberg `timestamp`, as declared in CatalogStack); values are UTC.
+    """
+    if pa.types.is_int8(arrow_type) or pa.types.is_int16(arrow_type):
+        return pa.int32()
+    if pa.types.is_timestamp(arrow_type):
+        return pa.timestamp("us")
+    return arrow_type
+
+
+def to_arrow(df, ingested_at, batch_id=None):
+    """
+    Convert a curated users DataFrame to an Arrow table for the Iceberg sink.
+
+    Nested field separators are replaced with underscores (location.city becomes
+    location_city) since dotted names clash with Iceberg nested-field lookups.
+    Column types are mapped with iceberg_compatible_type.
+
+    Args:
+        df: Curated users DataFrame
+        ingested_at: Timezone-aware datetime of the ingestion batch
+        batch_id: Request ID of the invocation that fetched the batch
+
+    Returns:
+        Arrow table with extra INGESTED_AT_COLUMN and BATCH_ID_COLUMN columns
+    """
+    arrow_table = pa.Table.from_pandas(df, preserve_index=False)
+    arrow_table = arrow_table.rename_columns([name.replace(".", "_") for name in arrow_table.column_names])
+    arrow_table = arrow_table.cast(pa.schema([
+        pa.field(field.name, iceberg_compatible_type(field.type)) for field in arrow_table.schema
+    ]))
+    ingested = pa.array([ingested_at] * arrow_table.num_rows, type=pa.timestamp("us"))
+    arrow_table = arrow_table.append_column(INGESTED_AT_COLUMN, ingested)
+    return arrow_table.append_column(BATCH_ID_COLUMN, pa.array([batch_id] * arrow_table.num_rows, type=pa.string()))
+
+
+def load_or_create_table(catalog, identifier, arrow_schema):
+    """
+    Load the users table, creating it (and its namespace) from arrow_schema if missing.
+
+    Columns present in arrow_schema but not in the table are added to the table schema.
+
+    Args:
+        catalog: pyiceberg Catalog
+        identifier: (namespace, table) tuple
+        arrow_schema: Schema of the batch to be written
+
+    Returns:
+        pyiceberg Table
+    """
+    try:
+        table = catalog.load_table(identifier)
+    except NoSuchTableError:
+        namespace = identifier[0]
+        if (namespace,) not in catalog.list_namespaces():
+            catalog.create_namespace(namespace)
+        logger.info(f"Creating Iceberg table {'.'.join(identifier)}")
+        return catalog.create_table(identifier, schema=arrow_schema, properties=TABLE_PROPERTIES)
+
+    new_columns = set(arrow_schema.names) - {field.name for field in table.schema().fields}
+    if new_columns:
+        logger.info(f"Adding columns to Iceberg table: {sorted(new_columns)}")
+        with table.update_schema() as update:
+            update.union_by_name(arrow_schema)
+
+    return table
+
+
+def align_to_table(table, arrow_table):
+    """
+    Reorder and cast a batch to the table schema, filling columns it lacks with nulls.
+
+    Args:
+        table: pyiceberg Table
+        arrow_table: Batch to be written
+
+    Returns:
+        Arrow table matching the table schema
+    """
+    target_schema = schema_to_pyarrow(table.schema())
+    columns = []
+    for field in target_schema:
+        if field.name in arrow_table.column_names:
+            columns.append(arrow_table.column(field.name).cast(field.type))
+        else:
+            columns.append(pa.nulls(arrow_table.num_rows, type=field.type))
+    return pa.Table.from_arrays(columns, schema=target_schema)
+
+
+def batch_committed(table, batch_id):
+    """Return whether rows of the batch are already in the table."""
+    scan = table.scan(row_filter=EqualTo(BATCH_ID_COLUMN, batch_id), selected_fields=(BATCH_ID_COLUMN,), limit=1)
+    return scan.to_arrow().num_rows > 0
+
+
+def write_users(df, ingested_at, catalog=None, identifier=None, batch_id=None):
+    """
+    Commit a curated users batch to the Iceberg table as a single snapshot.
+
+    Args:
+        df: Curated users DataFrame
+        ingested_at: Timezone-aware datetime of the ingestion batch
+        catalog: pyiceberg Catalog (defaults to get_catalog())
+        identifier: (namespace, table) tuple (defaults to table_identifier())
+        batch_id: Request ID of the invocation that fetched the batch; a batch
+            already in the table is not committed again
+
+    Returns:
+        ID of the committed snapshot, or None if the batch was already committed
+    """
+    catalog = catalog or get_catalog()
+    identifier = identifier or table_identifier()
+
+    arrow_table = to_arrow(df, ingested_at, batch_id)
+    table = load_or_create_table(catalog, identifier, arrow_table.schema)
+    if batch_id and batch_committed(table, batch_id):
+        logger.info(f"Batch {batch_id} is already committed to {'.'.join(identifier)}, skipping")
+        return None
+    table.append(align_to_table(table, arrow_table))
+
+    snapshot_id = table.current_snapshot().snapshot_id
+    logger.info(f"Iceberg snapshot {snapshot_id} committed to {'.'.join(identifier)} with {arrow_table.num_rows} row(s)")
+    return snapshot_id
@@ -0,0 +1,336 @@
+"""
+Storage backends and partition helpers for jobs that run outside the Lambda.
+
+Both backends expose the same small interface (list_keys, read, write, swap_partition)
+over the data bucket layout, so jobs run unchanged against S3, an S3-compatible
+local endpoint or a plain local directory. list_keys returns keys in lexicographic
+order and, like S3's StartAfter, can skip every key up to a given one.
+
+swap_partition(partition_prefix, files, delete_keys) writes `files`, removes
+`delete_keys` and keeps every other file of the partition untouched. Readers see
+the partition either before or after the swap (see each backend for how).
+"""
+import datetime
+import io
+import logging
+import os
+import shutil
+import uuid
+
+import boto3
+
+logger = logging.getLogger(__name__)
+
+# Folder prefix of the partition versions S3Storage swaps in through the Glue catalog
+VERSION_DIR_PREFIX = "_v="
+
+
+class LocalStorage:
+    """
+    Storage backend over a local directory that mirrors the bucket layout.
+
+    Each swap stages a complete new version of the partition in a hidden sibling
+    directory (unchanged files are hard-linked) and switches the partition, a
+    symlink to its current version, with a single atomic rename. Readers see either
+    the previous version or the new one. A partition that is still a plain directory
+    is converted on its first swap; only that first switch briefly leaves it missing.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def list_keys(self, prefix, start_after=None):
+        base = self._path(prefix)
+        if not os.path.isdir(base):
+            return []
+
+        keys = []
+        for dirpath, dirnames, filenames in os.walk(base, followlinks=True):
+            # Skip hidden partition versions and in-flight swaps
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            for filename in filenames:
+                rel = os.path.relpath(os.path.join(dirpath, filename), self.root)
+                keys.append(rel.replace(os.sep, "/"))
+        return sorted(key for key in keys if start_after is None or key > start_after)
+
+    def read(self, key):
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def write(self, key, body):
+        # Write next to the target and rename, so readers never see a partial file
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        staging_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{uuid.uuid4().hex}")
+        with open(staging_path, "wb") as f:
+            f.write(body)
+        os.replace(staging_path, path)
+
+    def swap_partition(self, partition_prefix, files, delete_keys=()):
+        if not files and not delete_keys:
+            return
+
+        live_dir = self._path(partition_prefix)
+        parent_dir, name = os.path.split(live_dir)
+        os.makedirs(parent_dir, exist_ok=True)
+        token = uuid.uuid4().hex
+        version_dir = os.path.join(parent_dir, f".{name}.v-{token}")
+
+        # Stage the new version; replaced files are unlinked before being written so
+        # the hard-linked originals in the live version stay untouched
+        if os.path.isdir(live_dir):
+            shutil.copytree(live_dir, version_dir, copy_function=os.link)
+        else:
+            os.makedirs(version_dir)
+        for key in [*delete_keys, *files]:
+            path = os.path.join(version_dir, os.path.relpath(self._path(key), live_dir))
+            if os.path.lexists(path):
+                os.remove(path)
+        for key, body in files.items():
+            path = os.path.join(version_dir, os.path.relpath(self._path(key), live_dir))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(body)
+
+        link = os.path.join(parent_dir, f".{name}.link-{token}")
+        os.symlink(os.path.basename(version_dir), link)
+        previous_dir = os.path.realpath(live_dir) if os.path.islink(live_dir) else None
+        if os.path.isdir(live_dir) and not os.path.islink(live_dir):
+            previous_dir = os.path.join(parent_dir, f".{name}.old-{token}")
+            os.rename(live_dir, previous_dir)
+        os.replace(link, live_dir)
+        if previous_dir:
+            shutil.rmtree(previous_dir, ignore_errors=True)
+
+
+class S3Storage:
+    """
+    Storage backend over an S3 bucket (or an S3-compatible local endpoint).
+
+    S3 has no multi-object rename, so prefixes registered in `glue_tables` are
+    versioned through the Glue catalog instead: a swap writes a complete new version
+    of the partition under `<partition>/_v=<token>/` (unchanged files are copied
+    server-side), switches the Glue partition location to it with a single
+    UpdatePartition call and only then deletes the previous version. Queries see
+    either the previous version or the new one. Athena and the crawler skip
+    `_`-prefixed folders, so a version is invisible until the partition points at it.
+
+    Keys stay logical: list_keys, read and write resolve a key of a versioned
+    partition to its current version, so callers never see `_v=` folders. Prefixes
+    that are not registered are swapped in place: each PUT replaces one object
+    atomically, but readers can see some files rewritten and others not yet.
+    """
+
+    def __init__(self, bucket_name, endpoint_url=None, client=None, glue_tables=None, glue_client=None):
+        """
+        Args:
+            bucket_name: Data bucket
+            endpoint_url: Optional S3 endpoint (e.g. a local MinIO or LocalStack)
+            client: boto3 S3 client (created on first use by default)
+            glue_tables: Dict mapping a data prefix (e.g. "raw/users") to the
+                (database, table) whose partitions are stored under it
+            glue_client: boto3 Glue client (created on first use by default)
+        """
+        self.bucket_name = bucket_name
+        self.endpoint_url = endpoint_url
+        self.glue_tables = dict(glue_tables or {})
+        self._client = client
+        self._glue_client = glue_client
+
+    def __getstate__(self):
+        # boto3 clients cannot be pickled into worker processes
+        state = self.__dict__.copy()
+        state["_client"] = None
+        state["_glue_client"] = None
+        return state
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = boto3.client("s3", endpoint_url=self.endpoint_url)
+        return self._client
+
+    @property
+    def glue_client(self):
+        if self._glue_client is None:
+            self._glue_client = boto3.client("glue")
+        return self._glue_client
+
+    def _glue_partition(self, key):
+        """Return (partition prefix, glue table, partition values) of a key under a registered prefix."""
+        for table_prefix, glue_table in self.glue_tables.items():
+            if not key.startswith(f"{table_prefix}/"):
+                continue
+            segments = []
+            for segment in key[len(table_prefix) + 1:].split("/"):
+                if "=" not in segment or segment.startswith(VERSION_DIR_PREFIX):
+                    break
+                segments.append(segment)
+            if segments:
+                values = [segment.split("=", 1)[1] for segment in segments]
+                return "/".join([table_prefix, *segments]), glue_table, values
+        return None
+
+    def _get_partition(self, glue_table, values):
+        try:
+            return self.glue_client.get_partition(
+                DatabaseName=glue_table[0], TableName=glue_table[1], PartitionValues=values
+            )["Partition"]
+        except self.glue_client.exceptions.EntityNotFoundException:
+            return None
+
+    def _current_version(self, key, versions):
+        """Return (partition prefix, prefix of its live version) for a key of a registered partition."""
+        located = self._glue_partition(key)
+        if located is None:
+            return None
+        partition, glue_table, values = located
+        if partition not in versions:
+            glue_partition = self._get_partition(glue_table, values)
+            location = glue_partition["StorageDescriptor"]["Location"].rstrip("/") if glue_partition else ""
+            version = location.rsplit("/", 1)[-1]
+            versions[partition] = f"{partition}/{version}" if version.startswith(VERSION_DIR_PREFIX) else partition
+        return partition, versions[partition]
+
+    def _physical_key(self, key):
+        current = self._current_version(key, {})
+        if current is None:
+            return key
+        partition, live_prefix = current
+        return f"{live_prefix}{key[len(partition):]}"
+
+    def _list_physical(self, prefix, start_after=None):
+        keys = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        params = {"Bucket": self.bucket_name, "Prefix": f"{prefix}/"}
+        if start_after is not None:
+            params["StartAfter"] = start_after
+        for page in paginator.paginate(**params):
+            keys.extend(obj["Key"] for obj in page.get("Contents", []))
+        return keys
+
+    def list_keys(self, prefix, start_after=None):
+        if not any(f"{p}/".startswith(f"{prefix}/") or prefix.startswith(f"{p}/") for p in self.glue_tables):
+            return sorted(self._list_physical(prefix, start_after=start_after))
+
+        versions = {}
+        keys = []
+        for key in self._list_physical(prefix):
+            current = self._current_version(key, versions)
+            if current is None:
+                keys.append(key)
+                continue
+            partition, live_prefix = current
+            # Keep only the files of the live version, under their logical key
+            if key.startswith(f"{live_prefix}/") and f"/{VERSION_DIR_PREFIX}" not in key[len(live_prefix):]:
+                keys.append(f"{partition}{key[len(live_prefix):]}")
+        return sorted(key for key in keys if start_after is None or key > start_after)
+
+    def read(self, key):
+        return self.client.get_object(Bucket=self.bucket_name, Key=self._physical_key(key))["Body"].read()
+
+    def write(self, key, body):
+        self.client.put_object(Bucket=self.bucket_name, Key=self._physical_key(key), Body=body)
+
+    def swap_partition(self, partition_prefix, files, delete_keys=()):
+        located = self._glue_partition(f"{partition_prefix}/")
+        if located is None:
+            for key, body in files.items():
+                self.client.put_object(Bucket=self.bucket_name, Key=key, Body=body)
+            for key in sorted(delete_keys):
+                self.client.delete_object(Bucket=self.bucket_name, Key=key)
+            return
+        if not files and not delete_keys:
+            return
+
+        _, glue_table, values = located
+        _, live_prefix = self._current_version(f"{partition_prefix}/", {})
+        live_keys = self.list_keys(partition_prefix)
+        version_prefix = f"{partition_prefix}/{VERSION_DIR_PREFIX}{uuid.uuid4().hex}"
+
+        # Stage the complete new version
+        for key in live_keys:
+            if key in files or key in delete_keys:
+                continue
+            self.client.copy_object(
+                Bucket=self.bucket_name,
+                Key=f"{version_prefix}{key[len(partition_prefix):]}",
+                CopySource={"Bucket": self.bucket_name, "Key": f"{live_prefix}{key[len(partition_prefix):]}"},
+            )
+        for key, body in files.items():
+            self.client.put_object(Bucket=self.bucket_name, Key=f"{version_prefix}{key[len(partition_prefix):]}", Body=body)
+
+        self._switch_partition(glue_table, values, f"s3://{self.bucket_name}/{version_prefix}/")
+
+        # Only the keys of the previous version listed above are removed, so a file
+        # written to the partition meanwhile is never deleted without a copy
+        for key in live_keys:
+            self.client.delete_object(Bucket=self.bucket_name, Key=f"{live_prefix}{key[len(partition_prefix):]}")
+
+    def _switch_partition(self, glue_table, values, location):
+        database, table = glue_table
+        glue_partition = self._get_partition(glue_table, values)
+        if glue_partition is None:
+            storage_descriptor = self.glue_client.get_table(DatabaseName=database, Name=table)["Table"]["StorageDescriptor"]
+            partition_input = {"Values": values, "StorageDescriptor": {**storage_descriptor, "Location": location}}
+            self.glue_client.create_partition(DatabaseName=database, TableName=table, PartitionInput=partition_input)
+        else:
+            partition_input = {
+                name: glue_partition[name] for name in ("Values", "Parameters") if name in glue_partition
+            }
+            partition_input["StorageDescriptor"] = {**glue_partition["StorageDescriptor"], "Location": location}
+            self.glue_client.update_partition(
+                DatabaseName=database, TableName=table, PartitionValueList=values, PartitionInput=partition_input
+            )
+        logger.info(f"Glue partition {database}.{table} {values} now reads {location}")
+
+
+def open_storage(location, endpoint_url=None, glue_tables=None):
+    """
+    Build the storage backend for a location.
+
+    Args:
+        location: s3://bucket for S3, anything else is treated as a local directory
+        endpoint_url: Optional S3 endpoint (e.g. a local MinIO or LocalStack)
+        glue_tables: For S3, dict mapping a data prefix to the Glue (database, table)
+            whose partitions are swapped through the catalog (see S3Storage)
+
+    Returns:
+        LocalStorage or S3Storage instance
+    """
+    if location.startswith("s3://"):
+        return S3Storage(location[len("s3://"):].strip("/"), endpoint_url=endpoint_url, glue_tables=glue_tables)
+    return LocalStorage(location)
+
+
+def partition_prefix(prefix, day):
+    """Return the Hive-style day partition prefix used by data_fetcher."""
+    return f"{prefix}/year={day.year}/month={day.month:02}/day={day.day:02}"
+
+
+def iter_days(start_date, end_date):
+    """Yield every date from start_date to end_date, both inclusive."""
+    day = start_date
+    while day <= end_date:
+        yield day
+        day += datetime.timedelta(days=1)
+
+
+def to_parquet_bytes(df):
+    """
+    Serialize a DataFrame to Parquet bytes.
+
+    Timestamps are stored as milliseconds, which every Athena engine version reads.
+    """
+    buffer = io.BytesIO()
+    df.to_parquet(
+        buffer,
+        engine='pyarrow',
+        index=False,
+        coerce_timestamps='ms',
+        allow_truncated_timestamps=True,
+    )
+    return buffer.getvalue()
@@ -0,0 +1,201 @@
+"""
+Per-run manifest index of the curated Parquet files.
+
+Every write of a curated file appends one small JSON entry to the index:
+
+    manifests/users/<YYYYMMDDTHHMMSSffffffZ>-<run_id>.json
+
+holding the file key, row count, byte size, min/max of the key columns and a
+fingerprint of the Parquet schema. Entries are separate objects, so concurrent
+runs never rewrite each other's entries, and their keys sort by time, so the files
+added since a watermark are found with a single listing that starts after it,
+without listing the data partitions. A key listed again was rewritten (replay or
+reprocess.py); its latest entry describes the current file.
+
+An entry is stamped right before it is written, but concurrent writers can land
+their entries out of stamp order. files_added_since therefore only returns entries
+stamped at least MAX_WRITE_LAG ago and hands back that cutoff as the next
+watermark, so an entry committed late is still returned by the next call:
+
+    python manifest.py since --storage s3://my-bucket --watermark 2026-01-31T00:00:00+00:00
+"""
+import argparse
+import datetime
+import hashlib
+import io
+import json
+import logging
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from lake_storage import open_storage
+
+logger = logging.getLogger(__name__)
+
+# Columns whose min/max are recorded, so consumers can prune files without opening them
+MANIFEST_KEY_COLUMNS = ["dob.age", "dob.date", "registered.age", "registered.date", "nat"]
+
+# Upper bound between stamping an entry and its write being visible. Well above the
+# 30 s timeout of the ingestion Lambda, which stamps its entry right before the PUT.
+MAX_WRITE_LAG = datetime.timedelta(minutes=5)
+
+_TIMESTAMP_FORMAT = "%Y%m%dT%H%M%S%fZ"
+
+
+def entry_key(manifest_prefix, added_at, run_id):
+    """Return the key of a manifest entry, sortable by its UTC added_at."""
+    added_at = added_at.astimezone(datetime.timezone.utc)
+    return f"{manifest_prefix}/{added_at.strftime(_TIMESTAMP_FORMAT)}-{run_id}.json"
+
+
+def schema_fingerprint(body):
+    """
+    Fingerprint the schema of a Parquet file.
+
+    Args:
+        body: Parquet file bytes
+
+    Returns:
+        Hex digest that changes whenever a column name or type changes
+    """
+    schema = pq.read_schema(io.BytesIO(body))
+    fields = ";".join(f"{field.name}:{field.type}" for field in schema)
+    return hashlib.sha256(fields.encode("utf-8")).hexdigest()[:16]
+
+
+def _json_value(value):
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+def column_bounds(df, columns=MANIFEST_KEY_COLUMNS):
+    """
+    Compute the min/max of the key columns present in a DataFrame.
+
+    Args:
+        df: Curated users DataFrame
+        columns: Columns to summarize
+
+    Returns:
+        Dict mapping column name to {"min": ..., "max": ...}; empty columns are left out
+    """
+    bounds = {}
+    for col in columns:
+        if col not in df.columns:
+            continue
+        values = df[col]
+        values = values.dropna()
+        if values.empty:
+            continue
+        bounds[col] = {"min": _json_value(values.min()), "max": _json_value(values.max())}
+    return bounds
+
+
+def build_entry(key, body, df):
+    """
+    Describe a curated Parquet file for the manifest index.
+
+    Args:
+        key: Key of the Parquet file
+        body: Parquet file bytes as written
+        df: DataFrame the file was written from
+
+    Returns:
+        Manifest entry dict (stamped with `added_at` by append_entry)
+    """
+    return {
+        "key": key,
+        "rows": len(df),
+        "bytes": len(body),
+        "schema_fingerprint": schema_fingerprint(body),
+        "columns": column_bounds(df),
+    }
+
+
+def append_entry(storage, manifest_prefix, entry, run_id, added_at=None):
+    """
+    Stamp an entry and append it to the manifest index.
+
+    Args:
+        storage: Storage backend from lake_storage
+        manifest_prefix: Prefix under which manifest entries are stored
+        entry: Manifest entry from build_entry, written after the file it describes
+        run_id: Run identifier, keeps keys unique across concurrent runs
+        added_at: Stamp of the entry (defaults to now)
+
+    Returns:
+        Key of the manifest entry
+    """
+    added_at = (added_at or datetime.datetime.now(datetime.timezone.utc)).astimezone(datetime.timezone.utc)
+    key = entry_key(manifest_prefix, added_at, run_id)
+    storage.write(key, json.dumps({**entry, "added_at": added_at.isoformat()}).encode("utf-8"))
+    logger.info(f"Manifest entry appended: {key}")
+    return key
+
+
+def files_added_since(storage, manifest_prefix, watermark=None, now=None, max_write_lag=MAX_WRITE_LAG):
+    """
+    Return the manifest entries of files added after a watermark.
+
+    Args:
+        storage: Storage backend from lake_storage.open_storage
+        manifest_prefix: Prefix under which manifest entries are stored
+        watermark: Timezone-aware datetime (exclusive) returned by the previous call;
+            None reads the index from the start
+        now: Current time (defaults to now)
+        max_write_lag: Entries stamped later than now - max_write_lag are left for
+            the next call, since an earlier-stamped entry may still be in flight
+
+    Returns:
+        Tuple (entries ordered by added_at, watermark to pass to the next call)
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    cutoff = (now - max_write_lag).astimezone(datetime.timezone.utc)
+    if watermark is not None and watermark >= cutoff:
+        return [], watermark
+
+    start_after = None
+    if watermark is not None:
+        watermark = watermark.astimezone(datetime.timezone.utc)
+        # "~" sorts after the "-<run_id>" suffix, so entries at the watermark itself are skipped
+        start_after = f"{manifest_prefix}/{watermark.strftime(_TIMESTAMP_FORMAT)}~"
+
+    entries = []
+    for key in storage.list_keys(manifest_prefix, start_after=start_after):
+        if not key.endswith(".json"):
+            continue
+        stamp = key[len(manifest_prefix) + 1:].split("-", 1)[0]
+        added_at = datetime.datetime.strptime(stamp, _TIMESTAMP_FORMAT).replace(tzinfo=datetime.timezone.utc)
+        if added_at > cutoff:
+            break
+        entries.append(json.loads(storage.read(key)))
+    return entries, cutoff
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Read the manifest index of curated files.")
+    subparsers = parser.add_subparsers(dest="operation", required=True)
+
+    since_parser = subparsers.add_parser("since", help="List files added after a watermark")
+    since_parser.add_argument("--storage", required=True, help="s3://bucket or a local directory")
+    since_parser.add_argument("--endpoint-url", default=None, help="S3 endpoint for a local S3 stand-in")
+    since_parser.add_argument("--manifest-prefix", default="manifests/users")
+    since_parser.add_argument(
+        "--watermark",
+        default=None,
+        type=datetime.datetime.fromisoformat,
+        help="ISO timestamp with offset, as returned by the previous run",
+    )
+
+    args = parser.parse_args(argv)
+    storage = open_storage(args.storage, endpoint_url=args.endpoint_url)
+    entries, watermark = files_added_since(storage, args.manifest_prefix, watermark=args.watermark)
+    print(json.dumps({"watermark": watermark.isoformat(), "entries": entries}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
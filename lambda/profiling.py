@@ -0,0 +1,137 @@
+"""
+On-demand profiling of a single handler invocation.
+
+Enabled per invocation with {"profile": true} in the event, or for every
+invocation with PROFILE_HANDLER=true. When profiling is off this module is not
+even imported. Artifacts for an invocation:
+
+    <request_id>.cpu.prof    cProfile stats (pstats / snakeviz compatible)
+    <request_id>.cpu.txt     Top functions by cumulative time
+    <request_id>.memory.txt  Peak traced memory and top allocation sites
+
+They are written to PROFILE_OUTPUT_DIR when set, otherwise to the data bucket
+under FILEPATH_PROFILES_STORAGE with the same year/month/day partitions as the output.
+"""
+import cProfile
+import datetime
+import io
+import logging
+import marshal
+import os
+import pstats
+import tracemalloc
+
+from decouple import config
+
+from lake_storage import partition_prefix
+
+logger = logging.getLogger(__name__)
+
+TOP_FUNCTIONS = 40
+TOP_ALLOCATION_SITES = 25
+
+# Frames of the profiler itself are left out of the allocation report
+_IGNORED_ALLOCATION_FILES = (
+    tracemalloc.__file__,
+    "<frozen importlib._bootstrap>",
+    "<frozen importlib._bootstrap_external>",
+)
+
+
+def cpu_report(profiler):
+    """Render the top functions of a profile by cumulative time."""
+    buffer = io.StringIO()
+    stats = pstats.Stats(profiler, stream=buffer)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+    return buffer.getvalue()
+
+
+def memory_report(snapshot, peak_bytes):
+    """Render peak traced memory and the top allocation sites of a snapshot."""
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, filename) for filename in _IGNORED_ALLOCATION_FILES
+    ])
+    lines = [f"Peak traced memory: {peak_bytes / 1024 / 1024:.1f} MiB", ""]
+    for index, stat in enumerate(snapshot.statistics("lineno")[:TOP_ALLOCATION_SITES], start=1):
+        frame = stat.traceback[0]
+        lines.append(
+            f"#{index}: {frame.filename}:{frame.lineno} "
+            f"{stat.size / 1024:.1f} KiB in {stat.count} block(s)"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def write_artifacts(artifacts, request_id, s3_client):
+    """
+    Store profiling artifacts locally or in the data bucket.
+
+    Args:
+        artifacts: Dict mapping file suffix to content bytes
+        request_id: Invocation ID used as the file name
+        s3_client: boto3 S3 client used when no local directory is configured
+
+    Returns:
+        List of written locations
+    """
+    output_dir = config("PROFILE_OUTPUT_DIR", default=None)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        locations = []
+        for suffix, body in artifacts.items():
+            path = os.path.join(output_dir, f"{request_id}{suffix}")
+            with open(path, "wb") as f:
+                f.write(body)
+            locations.append(path)
+        return locations
+
+    bucket_name = config("BUCKET_NAME")
+    prefix = partition_prefix(
+        config("FILEPATH_PROFILES_STORAGE", default="profiles"), datetime.datetime.now()
+    )
+    locations = []
+    for suffix, body in artifacts.items():
+        key = f"{prefix}/{request_id}{suffix}"
+        s3_client.put_object(Bucket=bucket_name, Key=key, Body=body)
+        locations.append(f"s3://{bucket_name}/{key}")
+    return locations
+
+
+def run_profiled(func, event, context, s3_client):
+    """
+    Run func(event, context) under cProfile and tracemalloc and store the artifacts.
+
+    Artifacts are written even when func raises. Failing to write them is logged
+    and never changes the outcome of the invocation.
+
+    Args:
+        func: Handler implementation
+        event: Lambda event data
+        context: Lambda runtime context
+        s3_client: boto3 S3 client
+
+    Returns:
+        The result of func(event, context)
+    """
+    logger.info("Profiling enabled for this invocation")
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
+    try:
+        return func(event, context)
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        try:
+            profiler.create_stats()
+            artifacts = {
+                ".cpu.prof": marshal.dumps(profiler.stats),
+                ".cpu.txt": cpu_report(profiler).encode("utf-8"),
+                ".memory.txt": memory_report(snapshot, peak_bytes).encode("utf-8"),
+            }
+            for location in write_artifacts(artifacts, context.aws_request_id, s3_client):
+                logger.info(f"Profiling artifact written: {location}")
+        except Exception as e:
+            logger.error(f"Failed to write profiling artifacts: {str(e)}", exc_info=True)
@@ -0,0 +1,253 @@
+"""
+Reprocessing job to rebuild curated Parquet partitions from stored data.
+
+Re-reads the source data of every day partition in a date range, applies the
+current transform from data_fetcher and swaps the new partition version in.
+Partitions are processed in parallel with a process pool.
+
+The source is chosen per curated file: a file is rebuilt from its raw API payload
+when one is stored under the raw prefix, and otherwise (files written before raw
+payloads were kept) from its own Parquet content. Only existing curated files are
+rewritten and none is deleted; raw payloads without a curated file, such as
+batches committed to the Iceberg table, are skipped.
+
+Each curated partition is swapped in atomically, so queries never see a
+half-rebuilt partition. On S3 the new version is written under a `_v=<token>` folder of the
+partition and the Glue partition of --glue-table is pointed at it (see
+lake_storage.S3Storage). Only finished days can be rebuilt: the ingestion Lambda
+keeps writing to the current day's partition.
+
+Partitions inherit the crawled table schema, so after a change of output types
+(a fix in data_fetcher.cast_columns, or switching TYPED_OUTPUT on with --typed)
+reprocess the whole history before the crawler runs again, otherwise old and new
+partitions disagree with the table schema.
+
+Usage:
+    python reprocess.py --start-date 2026-01-01 --end-date 2026-01-31 --storage s3://my-bucket
+    python reprocess.py --start-date 2026-01-01 --end-date 2026-01-31 --storage ./local-bucket
+    python reprocess.py ... --storage s3://my-bucket --endpoint-url http://localhost:9000
+"""
+import argparse
+import datetime
+import io
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from data_fetcher import (
+    QUARANTINE_EXTENSION,
+    RAW_PAYLOAD_EXTENSION,
+    decode_raw_payload,
+    quarantine_to_bytes,
+    raw_key_to_partition_key,
+    transform_users,
+)
+from lake_storage import iter_days, open_storage, partition_prefix, to_parquet_bytes
+from manifest import append_entry, build_entry
+
+logger = logging.getLogger(__name__)
+
+
+def rebuild_partition(storage, day, raw_prefix, filepath_base_storage, quarantine_prefix, manifest_prefix,
+                      typed=False):
+    """
+    Rebuild the curated files of one day partition with the current transform and swap them in.
+
+    The quarantine file of each rebuilt file is rewritten as well. For files rebuilt
+    from raw payloads it only holds the records rejected by the current rules; for
+    files rebuilt from Parquet, newly rejected records are appended to it, since the
+    previously quarantined ones are no longer in the curated file. Every rewritten
+    file gets a new entry in the manifest index once the swap is done.
+
+    Args:
+        storage: Storage backend
+        day: Partition date
+        raw_prefix: Prefix under which raw payloads are stored
+        filepath_base_storage: Prefix under which Parquet files are stored
+        quarantine_prefix: Prefix under which quarantined records are stored
+        manifest_prefix: Prefix of the manifest index (see manifest.py)
+        typed: Write the compact typed output (see data_fetcher.cast_columns)
+
+    Returns:
+        Summary dict with the partition, file counts per source and row counts
+    """
+    live_prefix = partition_prefix(filepath_base_storage, day)
+    quarantine_partition = partition_prefix(quarantine_prefix, day)
+
+    live_keys = [key for key in storage.list_keys(live_prefix) if key.endswith(".parquet")]
+    raw_keys = {
+        raw_key_to_partition_key(key, raw_prefix, filepath_base_storage): key
+        for key in storage.list_keys(partition_prefix(raw_prefix, day))
+        if key.endswith(RAW_PAYLOAD_EXTENSION)
+    }
+    existing_quarantine_keys = set(storage.list_keys(quarantine_partition))
+
+    files = {}
+    manifest_entries = {}
+    quarantine_files = {}
+    stale_quarantine_keys = set()
+    raw_files = 0
+    row_count = 0
+    quarantined_count = 0
+
+    for s3_key in live_keys:
+        file_name = s3_key.rsplit("/", 1)[-1][:-len(".parquet")]
+        quarantine_key = f"{quarantine_partition}/{file_name}{QUARANTINE_EXTENSION}"
+        raw_key = raw_keys.get(s3_key)
+
+        if raw_key:
+            data_users = decode_raw_payload(storage.read(raw_key)).get("results", [])
+            raw_files += 1
+        else:
+            # No raw payload kept for this file: re-read the curated file itself
+            data_users = pd.read_parquet(io.BytesIO(storage.read(s3_key))).to_dict("records")
+
+        df, quarantine_df = transform_users(data_users, typed=typed)
+        files[s3_key] = to_parquet_bytes(df)
+        manifest_entries[file_name] = build_entry(s3_key, files[s3_key], df)
+        row_count += len(df)
+        quarantined_count += len(quarantine_df)
+
+        if raw_key and len(quarantine_df):
+            quarantine_files[quarantine_key] = quarantine_to_bytes(quarantine_df)
+        elif raw_key and quarantine_key in existing_quarantine_keys:
+            stale_quarantine_keys.add(quarantine_key)
+        elif len(quarantine_df):
+            # Gzip members concatenate into a valid gzip file of JSON Lines
+            previous = storage.read(quarantine_key) if quarantine_key in existing_quarantine_keys else b""
+            quarantine_files[quarantine_key] = previous + quarantine_to_bytes(quarantine_df)
+
+    skipped_raw = len(set(raw_keys) - set(live_keys))
+    if skipped_raw:
+        logger.info(f"Partition {live_prefix}: skipped {skipped_raw} raw payload(s) without a curated file")
+
+    if files:
+        storage.swap_partition(quarantine_partition, quarantine_files, delete_keys=stale_quarantine_keys)
+        storage.swap_partition(live_prefix, files)
+        for file_name, entry in manifest_entries.items():
+            append_entry(storage, manifest_prefix, entry, file_name)
+        logger.info(
+            f"Partition {live_prefix} rebuilt: {raw_files} file(s) from raw, "
+            f"{len(files) - raw_files} from Parquet, {row_count} row(s), {quarantined_count} quarantined"
+        )
+
+    return {
+        "partition": live_prefix,
+        "files": len(files),
+        "raw_files": raw_files,
+        "parquet_files": len(files) - raw_files,
+        "skipped_raw": skipped_raw,
+        "rows": row_count,
+        "quarantined": quarantined_count,
+    }
+
+
+def reprocess(storage, start_date, end_date, raw_prefix, filepath_base_storage, quarantine_prefix,
+              manifest_prefix, typed=False, max_workers=None):
+    """
+    Rebuild every day partition in a date range in parallel.
+
+    Args:
+        storage: Storage backend
+        start_date: First partition date (inclusive)
+        end_date: Last partition date (inclusive)
+        raw_prefix: Prefix under which raw payloads are stored
+        filepath_base_storage: Prefix under which Parquet files are stored
+        quarantine_prefix: Prefix under which quarantined records are stored
+        manifest_prefix: Prefix of the manifest index (see manifest.py)
+        typed: Write the compact typed output (see data_fetcher.cast_columns)
+        max_workers: Process pool size (defaults to the CPU count)
+
+    Returns:
+        List of per-partition summaries for partitions that had data, ordered by date
+
+    Raises:
+        ValueError: If start_date is after end_date or end_date is not a finished day
+        RuntimeError: If any partition failed to rebuild
+    """
+    if start_date > end_date:
+        raise ValueError(f"start_date {start_date} is after end_date {end_date}")
+
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    if end_date >= today:
+        msg = f"end_date {end_date} is not a finished day; the ingestion still writes partitions from {today}"
+        logger.error(msg)
+        raise ValueError(msg)
+
+    days = list(iter_days(start_date, end_date))
+    logger.info(f"Reprocessing {len(days)} partition(s) from {start_date} to {end_date}")
+
+    results = []
+    failures = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                rebuild_partition,
+                storage,
+                day,
+                raw_prefix,
+                filepath_base_storage,
+                quarantine_prefix,
+                manifest_prefix,
+                typed,
+            ): day
+            for day in days
+        }
+        for future in as_completed(futures):
+            day = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"Partition {day} failed: {str(e)}")
+                failures.append(day)
+                continue
+            if result["files"]:
+                results.append(result)
+
+    if failures:
+        msg = f"Reprocessing failed for {len(failures)} partition(s): {', '.join(str(d) for d in sorted(failures))}"
+        logger.error(msg)
+        raise RuntimeError(msg)
+
+    return sorted(results, key=lambda r: r["partition"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild curated Parquet partitions for a date range.")
+    parser.add_argument("--start-date", required=True, type=datetime.date.fromisoformat)
+    parser.add_argument("--end-date", required=True, type=datetime.date.fromisoformat)
+    parser.add_argument("--storage", required=True, help="s3://bucket or a local directory")
+    parser.add_argument("--endpoint-url", default=None, help="S3 endpoint for a local S3 stand-in")
+    parser.add_argument("--base-prefix", default="raw/users")
+    parser.add_argument("--raw-prefix", default="raw_json/users")
+    parser.add_argument("--quarantine-prefix", default="quarantine/users")
+    parser.add_argument("--manifest-prefix", default="manifests/users")
+    parser.add_argument("--glue-database", default="mps-data-db")
+    parser.add_argument("--glue-table", default="mps_users", help="Glue table whose S3 partitions are switched")
+    parser.add_argument("--typed", action="store_true", help="Write the compact typed output")
+    parser.add_argument("--max-workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    storage = open_storage(
+        args.storage,
+        endpoint_url=args.endpoint_url,
+        glue_tables={args.base_prefix: (args.glue_database, args.glue_table)},
+    )
+    results = reprocess(
+        storage,
+        args.start_date,
+        args.end_date,
+        raw_prefix=args.raw_prefix,
+        filepath_base_storage=args.base_prefix,
+        quarantine_prefix=args.quarantine_prefix,
+        manifest_prefix=args.manifest_prefix,
+        typed=args.typed,
+        max_workers=args.max_workers,
+    )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
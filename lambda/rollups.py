@@ -0,0 +1,372 @@
+"""
+Daily rollup tables for dashboard queries.
+
+Each rollup is a small Parquet dataset partitioned by day. While a day is open,
+it holds one delta file per curated batch:
+
+    rollups/<name>/year=YYYY/month=MM/day=DD/<batch_id>.parquet
+
+The handler aggregates every new batch into its own delta files, named like the
+curated file of the batch, so the full detail table never has to be rescanned.
+Nothing is read back or merged on write: concurrent invocations cannot overwrite
+each other, and a retried invocation rewrites the same files instead of counting
+twice. Rows are partial aggregates; since the metrics (counts and sums) are
+additive, readers sum them by the dimensions (SUM(users) ... GROUP BY nat, gender,
+age_bucket), as read_rollup does.
+
+Once a day is over, close_day merges its deltas into a single file per rollup and
+drops them in the same swap:
+
+    rollups/<name>/year=YYYY/month=MM/day=DD/day.parquet
+
+The handler runs it for the previous day on a daily schedule ({"mode":
+"close_rollups"}). For backfills, after reprocessing or replaying curated
+partitions, the rebuild command recomputes whole days from the curated Parquet
+files, writing finished days directly as their single file:
+
+    python rollups.py rebuild --start-date 2026-01-01 --end-date 2026-01-31 --storage s3://my-bucket
+    python rollups.py rebuild --start-date 2026-01-01 --end-date 2026-01-31 --storage ./local-bucket
+    python rollups.py close --start-date 2026-01-01 --end-date 2026-01-31 --storage s3://my-bucket
+"""
+import argparse
+import datetime
+import io
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+
+from lake_storage import iter_days, open_storage, partition_prefix, to_parquet_bytes
+
+logger = logging.getLogger(__name__)
+
+# Rollup name -> grouping dimensions
+ROLLUPS = {
+    "users_daily_demographics": ["nat", "gender", "age_bucket"],
+    "users_daily_cohorts": ["nat", "gender", "registration_cohort"],
+}
+
+# Additive metrics, so partial rollups can be merged by summing
+METRIC_COLUMNS = ["users", "dob_age_sum", "registered_age_sum"]
+
+# Batch ID of the single rollup file of a closed day
+CLOSED_DAY_BATCH_ID = "day"
+
+AGE_BUCKET_EDGES = [0, 18, 25, 35, 45, 55, 65, np.inf]
+AGE_BUCKET_LABELS = ["<18", "18-24", "25-34", "35-44", "45-54", "55-64", "65+"]
+
+
+def rollup_key(rollups_prefix, name, day, batch_id):
+    """Return the key of the rollup file of one batch."""
+    return f"{partition_prefix(f'{rollups_prefix}/{name}', day)}/{batch_id}.parquet"
+
+
+def add_dimensions(df):
+    """
+    Derive the rollup dimensions from a curated users DataFrame.
+
+    Args:
+        df: Curated users DataFrame (as written to Parquet)
+
+    Returns:
+        DataFrame with the dimension and metric source columns used by ROLLUPS
+    """
+    dob_age = pd.to_numeric(df["dob.age"], errors="coerce")
+    registered_age = pd.to_numeric(df["registered.age"], errors="coerce")
+
+    age_bucket = pd.cut(dob_age, bins=AGE_BUCKET_EDGES, labels=AGE_BUCKET_LABELS, right=False)
+    registered_year = pd.to_datetime(df["registered.date"], errors="coerce", utc=True).dt.year
+
+    return pd.DataFrame({
+        "nat": df["nat"].astype(str),
+        "gender": df["gender"].astype(str),
+        "age_bucket": age_bucket.astype(str).where(age_bucket.notna(), "unknown"),
+        "registration_cohort": registered_year.astype("Int64").astype(str).where(registered_year.notna(), "unknown"),
+        "dob_age": dob_age.fillna(0).astype("int64"),
+        "registered_age": registered_age.fillna(0).astype("int64"),
+    })
+
+
+def aggregate(df):
+    """
+    Compute every rollup for a batch of curated users.
+
+    Args:
+        df: Curated users DataFrame
+
+    Returns:
+        Dict mapping rollup name to its aggregated DataFrame
+    """
+    if df.empty:
+        return {name: empty_rollup(dimensions) for name, dimensions in ROLLUPS.items()}
+
+    dimensions_df = add_dimensions(df)
+    rollups = {}
+    for name, dimensions in ROLLUPS.items():
+        rollups[name] = (
+            dimensions_df.groupby(dimensions, observed=True)
+            .agg(
+                users=("dob_age", "size"),
+                dob_age_sum=("dob_age", "sum"),
+                registered_age_sum=("registered_age", "sum"),
+            )
+            .reset_index()
+            .astype({column: "int64" for column in METRIC_COLUMNS})
+        )
+    return rollups
+
+
+def empty_rollup(dimensions):
+    """Return an empty rollup DataFrame with the expected columns and types."""
+    columns = {dimension: pd.Series(dtype="object") for dimension in dimensions}
+    columns.update({metric: pd.Series(dtype="int64") for metric in METRIC_COLUMNS})
+    return pd.DataFrame(columns)
+
+
+def merge(existing, batch, dimensions):
+    """
+    Merge a batch rollup into an existing rollup by summing the metrics.
+
+    Args:
+        existing: Existing rollup DataFrame, or None
+        batch: Rollup DataFrame of the new batch
+        dimensions: Grouping dimensions of the rollup
+
+    Returns:
+        Merged rollup DataFrame sorted by its dimensions
+    """
+    combined = batch if existing is None else pd.concat([existing, batch], ignore_index=True)
+    return (
+        combined.groupby(dimensions, observed=True)[METRIC_COLUMNS].sum()
+        .reset_index()
+        .sort_values(dimensions, ignore_index=True)
+    )
+
+
+def update_rollups(df, storage, rollups_prefix, day, batch_id):
+    """
+    Write the rollups of a new batch to its own files.
+
+    Args:
+        df: Curated users DataFrame of the batch
+        storage: Storage backend from lake_storage
+        rollups_prefix: Prefix under which rollup datasets are stored
+        day: Partition date of the batch
+        batch_id: Batch identifier (the file name of its curated Parquet file)
+
+    Returns:
+        List of written rollup keys
+    """
+    written = []
+    for name, batch_rollup in aggregate(df).items():
+        key = rollup_key(rollups_prefix, name, day, batch_id)
+        storage.write(key, to_parquet_bytes(batch_rollup.sort_values(ROLLUPS[name], ignore_index=True)))
+        written.append(key)
+        logger.info(f"Rollup written: {key} ({len(batch_rollup)} row(s))")
+    return written
+
+
+def _rollup_keys(storage, rollups_prefix, name, day):
+    return [
+        key for key in storage.list_keys(partition_prefix(f"{rollups_prefix}/{name}", day))
+        if key.endswith(".parquet")
+    ]
+
+
+def _merge_files(storage, keys, name):
+    rollup = None
+    for key in keys:
+        rollup = merge(rollup, pd.read_parquet(io.BytesIO(storage.read(key))), ROLLUPS[name])
+    return empty_rollup(ROLLUPS[name]) if rollup is None else rollup
+
+
+def read_rollup(storage, rollups_prefix, name, day):
+    """
+    Read the rollup of one day, summing the partial aggregates of its files.
+
+    Args:
+        storage: Storage backend from lake_storage
+        rollups_prefix: Prefix under which rollup datasets are stored
+        name: Rollup name (a key of ROLLUPS)
+        day: Partition date
+
+    Returns:
+        Rollup DataFrame sorted by its dimensions
+    """
+    return _merge_files(storage, _rollup_keys(storage, rollups_prefix, name, day), name)
+
+
+def close_day(storage, rollups_prefix, day):
+    """
+    Merge the delta files of a finished day into a single file per rollup.
+
+    The merged file and the removal of the deltas are one swap_partition. Only call
+    it for days no invocation writes to anymore: the handler stamps a batch with its
+    start time and times out after 30 seconds, so a day is final shortly after midnight.
+
+    Args:
+        storage: Storage backend from lake_storage
+        rollups_prefix: Prefix under which rollup datasets are stored
+        day: Partition date
+
+    Returns:
+        Number of files merged, 0 if the day was already closed or has no rollups
+    """
+    merged_files = 0
+    for name in ROLLUPS:
+        closed_key = rollup_key(rollups_prefix, name, day, CLOSED_DAY_BATCH_ID)
+        keys = _rollup_keys(storage, rollups_prefix, name, day)
+        if not keys or keys == [closed_key]:
+            continue
+        storage.swap_partition(
+            partition_prefix(f"{rollups_prefix}/{name}", day),
+            {closed_key: to_parquet_bytes(_merge_files(storage, keys, name))},
+            delete_keys=set(keys) - {closed_key},
+        )
+        merged_files += len(keys)
+    if merged_files:
+        logger.info(f"Rollups closed for {day}: {merged_files} file(s) merged")
+    return merged_files
+
+
+def close_days(storage, start_date, end_date, rollups_prefix):
+    """
+    Close every finished day in a range (see close_day).
+
+    Args:
+        storage: Storage backend from lake_storage.open_storage
+        start_date: First day (inclusive)
+        end_date: Last day (inclusive)
+        rollups_prefix: Prefix under which rollup datasets are stored
+
+    Returns:
+        List of per-day summaries for days that had files to merge
+
+    Raises:
+        ValueError: If start_date is after end_date or end_date is not a finished day
+    """
+    if start_date > end_date:
+        raise ValueError(f"start_date {start_date} is after end_date {end_date}")
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    if end_date >= today:
+        msg = f"end_date {end_date} is not a finished day"
+        logger.error(msg)
+        raise ValueError(msg)
+
+    results = []
+    for day in iter_days(start_date, end_date):
+        merged_files = close_day(storage, rollups_prefix, day)
+        if merged_files:
+            results.append({"day": day.isoformat(), "files": merged_files})
+    return results
+
+
+def rebuild(storage, start_date, end_date, filepath_base_storage, rollups_prefix):
+    """
+    Recompute the rollups of every day in a range from the curated Parquet files.
+
+    Finished days are written as a single closed file per rollup; the current day
+    gets one delta file per curated file, as the handler writes them. Any other
+    rollup file of a rebuilt day is removed in the same swap.
+
+    Args:
+        storage: Storage backend from lake_storage.open_storage
+        start_date: First day (inclusive)
+        end_date: Last day (inclusive)
+        filepath_base_storage: Prefix under which curated Parquet files are stored
+        rollups_prefix: Prefix under which rollup datasets are stored
+
+    Returns:
+        List of per-day summaries for days that had curated data
+
+    Raises:
+        ValueError: If start_date is after end_date
+    """
+    if start_date > end_date:
+        raise ValueError(f"start_date {start_date} is after end_date {end_date}")
+
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    results = []
+    for day in iter_days(start_date, end_date):
+        # Listed before the curated files: a batch whose rollup is listed here wrote its
+        # curated file first, so it is rebuilt below rather than deleted
+        existing = {
+            name: set(storage.list_keys(partition_prefix(f"{rollups_prefix}/{name}", day)))
+            for name in ROLLUPS
+        }
+        keys = [
+            key for key in storage.list_keys(partition_prefix(filepath_base_storage, day))
+            if key.endswith(".parquet")
+        ]
+        if not keys:
+            continue
+
+        files = {name: {} for name in ROLLUPS}
+        closed = {name: None for name in ROLLUPS}
+        row_count = 0
+        for key in keys:
+            df = pd.read_parquet(io.BytesIO(storage.read(key)))
+            batch_id = key.rsplit("/", 1)[-1][:-len(".parquet")]
+            row_count += len(df)
+            for name, rollup in aggregate(df).items():
+                if day < today:
+                    closed[name] = merge(closed[name], rollup, ROLLUPS[name])
+                else:
+                    rollup = rollup.sort_values(ROLLUPS[name], ignore_index=True)
+                    files[name][rollup_key(rollups_prefix, name, day, batch_id)] = to_parquet_bytes(rollup)
+        if day < today:
+            files = {
+                name: {rollup_key(rollups_prefix, name, day, CLOSED_DAY_BATCH_ID): to_parquet_bytes(rollup)}
+                for name, rollup in closed.items()
+            }
+
+        for name in ROLLUPS:
+            storage.swap_partition(
+                partition_prefix(f"{rollups_prefix}/{name}", day),
+                files[name],
+                delete_keys=existing[name] - set(files[name]),
+            )
+
+        logger.info(f"Rollups rebuilt for {day} from {len(keys)} file(s), {row_count} row(s)")
+        results.append({"day": day.isoformat(), "files": len(keys), "rows": row_count})
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the daily rollup datasets.")
+    subparsers = parser.add_subparsers(dest="operation", required=True)
+
+    rebuild_parser = subparsers.add_parser("rebuild", help="Recompute rollups for a date range")
+    rebuild_parser.add_argument("--start-date", required=True, type=datetime.date.fromisoformat)
+    rebuild_parser.add_argument("--end-date", required=True, type=datetime.date.fromisoformat)
+    rebuild_parser.add_argument("--storage", required=True, help="s3://bucket or a local directory")
+    rebuild_parser.add_argument("--endpoint-url", default=None, help="S3 endpoint for a local S3 stand-in")
+    rebuild_parser.add_argument("--base-prefix", default="raw/users")
+    rebuild_parser.add_argument("--rollups-prefix", default="rollups")
+
+    close_parser = subparsers.add_parser("close", help="Merge the delta files of finished days")
+    close_parser.add_argument("--start-date", required=True, type=datetime.date.fromisoformat)
+    close_parser.add_argument("--end-date", required=True, type=datetime.date.fromisoformat)
+    close_parser.add_argument("--storage", required=True, help="s3://bucket or a local directory")
+    close_parser.add_argument("--endpoint-url", default=None, help="S3 endpoint for a local S3 stand-in")
+    close_parser.add_argument("--rollups-prefix", default="rollups")
+
+    args = parser.parse_args(argv)
+    storage = open_storage(args.storage, endpoint_url=args.endpoint_url)
+    if args.operation == "rebuild":
+        results = rebuild(
+            storage,
+            args.start_date,
+            args.end_date,
+            filepath_base_storage=args.base_prefix,
+            rollups_prefix=args.rollups_prefix,
+        )
+    else:
+        results = close_days(storage, args.start_date, args.end_date, rollups_prefix=args.rollups_prefix)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
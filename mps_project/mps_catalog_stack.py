@@ -1,3 +1,5 @@
+import json
+
 from aws_cdk import (
     Stack,
     CfnOutput,
@@ -9,19 +11,100 @@ from constructs import Construct
 from aws_cdk.aws_s3 import Bucket
 from decouple import config
 
+# Columns of the curated users Parquet files, as written by lambda/data_fetcher.py
+USERS_COLUMNS = [
+    ("gender", "string"),
+    ("email", "string"),
+    ("phone", "string"),
+    ("cell", "string"),
+    ("nat", "string"),
+    ("name.title", "string"),
+    ("name.first", "string"),
+    ("name.last", "string"),
+    ("location.street.number", "bigint"),
+    ("location.street.name", "string"),
+    ("location.city", "string"),
+    ("location.state", "string"),
+    ("location.country", "string"),
+    ("location.postcode", "string"),
+    ("location.coordinates.latitude", "string"),
+    ("location.coordinates.longitude", "string"),
+    ("location.timezone.offset", "string"),
+    ("location.timezone.description", "string"),
+    ("login.uuid", "string"),
+    ("login.username", "string"),
+    ("login.password", "string"),
+    ("login.salt", "string"),
+    ("login.md5", "string"),
+    ("login.sha1", "string"),
+    ("login.sha256", "string"),
+    ("dob.date", "string"),
+    ("dob.age", "bigint"),
+    ("registered.date", "string"),
+    ("registered.age", "bigint"),
+    ("id.name", "string"),
+    ("id.value", "string"),
+    ("picture.large", "string"),
+    ("picture.medium", "string"),
+    ("picture.thumbnail", "string"),
+]
+
+# Column types of the typed output (TYPED_OUTPUT=true). Must stay consistent with
+# TYPED_TIMESTAMP_COLUMNS and TYPED_NUMERIC_COLUMNS in lambda/data_fetcher.py.
+USERS_TYPED_COLUMN_TYPES = {
+    "location.street.number": "smallint",
+    "location.coordinates.latitude": "float",
+    "location.coordinates.longitude": "float",
+    "dob.date": "timestamp",
+    "dob.age": "tinyint",
+    "registered.date": "timestamp",
+    "registered.age": "tinyint",
+}
+
+# Columns of the users Iceberg table: nested field dots replaced with underscores
+# (see lambda/iceberg_sink.py) plus the batch timestamp and ID. Iceberg has no
+# 8/16-bit integers, so narrowed integers are stored as int.
+ICEBERG_USERS_COLUMNS = [
+    (name.replace(".", "_"), column_type) for name, column_type in USERS_COLUMNS
+] + [("ingested_at", "timestamp"), ("batch_id", "string")]
+ICEBERG_TYPED_COLUMN_TYPES = {
+    name.replace(".", "_"): {"tinyint": "int", "smallint": "int"}.get(column_type, column_type)
+    for name, column_type in USERS_TYPED_COLUMN_TYPES.items()
+}
+
+# Maintenance of the users Iceberg table by the Glue table optimizers
+ICEBERG_SNAPSHOT_RETENTION_DAYS = 7
+ICEBERG_SNAPSHOTS_TO_RETAIN = 5
+ICEBERG_ORPHAN_FILE_RETENTION_DAYS = 3
+
+# Daily rollup tables: name -> dimension columns (all strings).
+# Must stay consistent with ROLLUPS in lambda/rollups.py.
+ROLLUP_TABLES = {
+    "users_daily_demographics": ["nat", "gender", "age_bucket"],
+    "users_daily_cohorts": ["nat", "gender", "registration_cohort"],
+}
+ROLLUP_METRIC_COLUMNS = ["users", "dob_age_sum", "registered_age_sum"]
+
 class CatalogStack(Stack):
     """
     AWS Glue Catalog Stack for MPS Project.
     
     Creates a Glue Database and Crawler to automatically catalog data in S3 using Hive partitioning.
     The crawler scans S3 for Parquet files and updates the Data Catalog with schema information.
+    With typed output the users table is declared with the typed schema and the crawler
+    only adds partitions to it. Optionally creates a Glue-backed Apache Iceberg table
+    for the users dataset.
     
     Attributes:
         data_catalog_db: AWS Glue Database for metadata
         data_crawler: AWS Glue Crawler for schema detection
+        users_table: Glue table with the typed schema (None unless typed_output is set)
+        iceberg_users_table: Glue Iceberg table (None unless enable_iceberg is set)
+        iceberg_optimizers: Glue table optimizers of the Iceberg table, keyed by type
+        rollup_tables: Glue tables for the daily rollup datasets, keyed by rollup name
     """
 
-    def __init__(self, scope: Construct, construct_id: str, data_bucket: Bucket, **kwargs) -> None:
+    def __init__(self, scope: Construct, construct_id: str, data_bucket: Bucket, enable_iceberg: bool = False, typed_output: bool = False, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
         # Validate input
@@ -95,26 +178,82 @@ class CatalogStack(Stack):
         # Grant S3 permissions for Lake Formation data location access
         data_bucket.grant_read_write(crawler_role)
 
-        # 3. Create Glue Crawler
-        self.data_crawler = glue.CfnCrawler(
-            self, 
-            id="MPS-UserDataCrawler",
-            name="mps-user-data-crawler",
-            role=crawler_role.role_arn,
-            database_name=self.data_catalog_db.ref,
-            targets=glue.CfnCrawler.TargetsProperty(
+        # 3. Create the users table with an explicit schema (typed output only)
+        # Without typed output the crawler infers the table. With it, the schema is
+        # declared here and the crawler only registers new partitions, which inherit it.
+        # Switching TYPED_OUTPUT on an existing deployment: rewrite the whole history
+        # with `reprocess.py --typed` first, then delete the crawled mps_users table and
+        # deploy, so no partition keeps the previous physical types.
+        self.users_table = None
+        if typed_output:
+            self.users_table = glue.CfnTable(
+                self,
+                id="MPS-UsersTable",
+                catalog_id=self.account,
+                database_name=self.data_catalog_db.ref,
+                table_input=glue.CfnTable.TableInputProperty(
+                    name="mps_users",
+                    description="Users from the Random User API (typed output)",
+                    table_type="EXTERNAL_TABLE",
+                    parameters={"classification": "parquet"},
+                    partition_keys=[
+                        glue.CfnTable.ColumnProperty(name=key, type="string")
+                        for key in ("year", "month", "day")
+                    ],
+                    storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
+                        location=f"s3://{data_bucket.bucket_name}/{filepath_base_storage}/",
+                        input_format="org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat",
+                        output_format="org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat",
+                        serde_info=glue.CfnTable.SerdeInfoProperty(
+                            serialization_library="org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
+                        ),
+                        columns=[
+                            glue.CfnTable.ColumnProperty(name=name, type=USERS_TYPED_COLUMN_TYPES.get(name, column_type))
+                            for name, column_type in USERS_COLUMNS
+                        ]
+                    )
+                )
+            )
+            self.users_table.add_dependency(self.data_catalog_db)
+            crawler_targets = glue.CfnCrawler.TargetsProperty(
+                catalog_targets=[
+                    glue.CfnCrawler.CatalogTargetProperty(
+                        database_name=self.data_catalog_db.ref,
+                        tables=["mps_users"]
+                    )
+                ]
+            )
+            # Crawlers over catalog targets must leave the declared schema alone
+            schema_change_policy = glue.CfnCrawler.SchemaChangePolicyProperty(
+                delete_behavior="LOG",
+                update_behavior="LOG"
+            )
+        else:
+            crawler_targets = glue.CfnCrawler.TargetsProperty(
                 s3_targets=[
                     glue.CfnCrawler.S3TargetProperty(
                         path=f"s3://{data_bucket.bucket_name}/{filepath_base_storage}/",
-                        # Exclude partitions metadata files
-                        exclusions=["**.json", "**.yaml", "**.txt"]
+                        # Exclude partitions metadata files, compressed raw API payloads and
+                        # the partition versions written by reprocess.py, which are only
+                        # read through the partition location it sets
+                        exclusions=["**.json", "**.json.gz", "**.yaml", "**.txt", "**/_v=*/**"]
                     )
                 ]
-            ),
-            schema_change_policy=glue.CfnCrawler.SchemaChangePolicyProperty(
+            )
+            schema_change_policy = glue.CfnCrawler.SchemaChangePolicyProperty(
                 delete_behavior="DEPRECATE_IN_DATABASE",
                 update_behavior="UPDATE_IN_DATABASE"
-            ),
+            )
+
+        # 4. Create Glue Crawler
+        self.data_crawler = glue.CfnCrawler(
+            self, 
+            id="MPS-UserDataCrawler",
+            name="mps-user-data-crawler",
+            role=crawler_role.role_arn,
+            database_name=self.data_catalog_db.ref,
+            targets=crawler_targets,
+            schema_change_policy=schema_change_policy,
             # Crawler configuration
             description="Crawler for scanning Hive-partitioned Parquet files from Random User API",
             schedule=glue.CfnCrawler.ScheduleProperty(
@@ -122,7 +261,171 @@ class CatalogStack(Stack):
             ),
             # SchemaChangePolicy detects new columns automatically
             table_prefix="mps_",
+            # Partitions inherit the table schema, so every partition must hold the same physical types
+            configuration=json.dumps({
+                "Version": 1.0,
+                "CrawlerOutput": {
+                    "Partitions": {"AddOrUpdateBehavior": "InheritFromTable"}
+                }
+            }),
         )
+        if self.users_table is not None:
+            self.data_crawler.add_dependency(self.users_table)
+
+        # 5. Create Glue-backed Iceberg table (optional)
+        # Stored outside the crawler path; Glue writes the initial Iceberg metadata
+        self.iceberg_users_table = None
+        self.iceberg_optimizers = {}
+        if enable_iceberg:
+            self.iceberg_users_table = glue.CfnTable(
+                self,
+                id="MPS-UsersIcebergTable",
+                catalog_id=self.account,
+                database_name=self.data_catalog_db.ref,
+                open_table_format_input=glue.CfnTable.OpenTableFormatInputProperty(
+                    iceberg_input=glue.CfnTable.IcebergInputProperty(
+                        metadata_operation="CREATE",
+                        version="2"
+                    )
+                ),
+                table_input=glue.CfnTable.TableInputProperty(
+                    name="mps_users_iceberg",
+                    description="Users from the Random User API as an Apache Iceberg table",
+                    table_type="EXTERNAL_TABLE",
+                    storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
+                        location=f"s3://{data_bucket.bucket_name}/iceberg/users",
+                        columns=[
+                            glue.CfnTable.ColumnProperty(
+                                name=name,
+                                type=ICEBERG_TYPED_COLUMN_TYPES.get(name, column_type) if typed_output else column_type
+                            )
+                            for name, column_type in ICEBERG_USERS_COLUMNS
+                        ]
+                    )
+                )
+            )
+            self.iceberg_users_table.add_dependency(self.data_catalog_db)
+
+            # Glue compacts small data files, expires old snapshots (deleting the files
+            # only they referenced) and removes orphan files on its own schedule
+            optimizer_role = iam.Role(
+                self,
+                id="MPS-IcebergOptimizerRole",
+                assumed_by=iam.ServicePrincipal("glue.amazonaws.com"),
+                description="Role for the Glue table optimizers of the users Iceberg table",
+            )
+            data_bucket.grant_read_write(optimizer_role, "iceberg/*")
+            optimizer_role.add_to_policy(
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=["glue:GetTable", "glue:UpdateTable", "glue:GetDatabase"],
+                    resources=[
+                        f"arn:aws:glue:{self.region}:{self.account}:catalog",
+                        f"arn:aws:glue:{self.region}:{self.account}:database/{self.data_catalog_db.ref}",
+                        f"arn:aws:glue:{self.region}:{self.account}:table/{self.data_catalog_db.ref}/mps_users_iceberg",
+                    ]
+                )
+            )
+            optimizer_role.add_to_policy(
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=["logs:CreateLogGroup", "logs:CreateLogStream", "logs:PutLogEvents"],
+                    resources=[f"arn:aws:logs:{self.region}:{self.account}:log-group:/aws-glue/iceberg-*"]
+                )
+            )
+            optimizer_role.add_to_policy(
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=["lakeformation:GetDataAccess"],
+                    resources=["*"]
+                )
+            )
+
+            optimizer_settings = {
+                "compaction": {},
+                "retention": {
+                    "retention_configuration": glue.CfnTableOptimizer.RetentionConfigurationProperty(
+                        iceberg_configuration=glue.CfnTableOptimizer.IcebergRetentionConfigurationProperty(
+                            snapshot_retention_period_in_days=ICEBERG_SNAPSHOT_RETENTION_DAYS,
+                            number_of_snapshots_to_retain=ICEBERG_SNAPSHOTS_TO_RETAIN,
+                            clean_expired_files=True
+                        )
+                    )
+                },
+                "orphan_file_deletion": {
+                    "orphan_file_deletion_configuration": glue.CfnTableOptimizer.OrphanFileDeletionConfigurationProperty(
+                        iceberg_configuration=glue.CfnTableOptimizer.IcebergConfigurationProperty(
+                            orphan_file_retention_period_in_days=ICEBERG_ORPHAN_FILE_RETENTION_DAYS
+                        )
+                    )
+                },
+            }
+            for optimizer_type, settings in optimizer_settings.items():
+                optimizer = glue.CfnTableOptimizer(
+                    self,
+                    id=f"MPS-IcebergOptimizer-{optimizer_type}",
+                    catalog_id=self.account,
+                    database_name=self.data_catalog_db.ref,
+                    table_name="mps_users_iceberg",
+                    type=optimizer_type,
+                    table_optimizer_configuration=glue.CfnTableOptimizer.TableOptimizerConfigurationProperty(
+                        enabled=True,
+                        role_arn=optimizer_role.role_arn,
+                        **settings
+                    )
+                )
+                optimizer.add_dependency(self.iceberg_users_table)
+                self.iceberg_optimizers[optimizer_type] = optimizer
+
+        # 6. Create daily rollup tables
+        # Partition projection resolves year/month/day partitions without a crawler
+        self.rollup_tables = {}
+        for rollup_name, dimensions in ROLLUP_TABLES.items():
+            rollup_location = f"s3://{data_bucket.bucket_name}/rollups/{rollup_name}"
+            self.rollup_tables[rollup_name] = glue.CfnTable(
+                self,
+                id=f"MPS-Rollup-{rollup_name}",
+                catalog_id=self.account,
+                database_name=self.data_catalog_db.ref,
+                table_input=glue.CfnTable.TableInputProperty(
+                    name=f"mps_{rollup_name}",
+                    description=f"Daily rollup of users by {', '.join(dimensions)} (one file per batch until the day is closed; sum the metrics)",
+                    table_type="EXTERNAL_TABLE",
+                    parameters={
+                        "classification": "parquet",
+                        "projection.enabled": "true",
+                        "projection.year.type": "integer",
+                        "projection.year.range": "2024,2100",
+                        "projection.month.type": "integer",
+                        "projection.month.range": "1,12",
+                        "projection.month.digits": "2",
+                        "projection.day.type": "integer",
+                        "projection.day.range": "1,31",
+                        "projection.day.digits": "2",
+                        "storage.location.template": f"{rollup_location}/year=${{year}}/month=${{month}}/day=${{day}}",
+                    },
+                    partition_keys=[
+                        glue.CfnTable.ColumnProperty(name=key, type="string")
+                        for key in ("year", "month", "day")
+                    ],
+                    storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
+                        location=rollup_location,
+                        input_format="org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat",
+                        output_format="org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat",
+                        serde_info=glue.CfnTable.SerdeInfoProperty(
+                            serialization_library="org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
+                        ),
+                        columns=[
+                            glue.CfnTable.ColumnProperty(name=dimension, type="string")
+                            for dimension in dimensions
+                        ] + [
+                            glue.CfnTable.ColumnProperty(name=metric, type="bigint")
+                            for metric in ROLLUP_METRIC_COLUMNS
+                        ]
+                    )
+                )
+            )
+            self.rollup_tables[rollup_name].add_dependency(self.data_catalog_db)
 
         # Export outputs
         CfnOutput(
@@ -4,6 +4,8 @@ from aws_cdk import (
     Stack,
     CfnOutput,
     RemovalPolicy,
+    aws_events as events,
+    aws_events_targets as targets,
     aws_iam as iam,
     aws_lambda as _lambda,
     aws_logs as logs,
@@ -14,13 +16,16 @@ class MpsIngestionStack(Stack):
     """
     Ingestion Stack for MPS Project.
     
-    Creates a Lambda function that fetches data and writes to S3 bucket.
+    Creates a Lambda function that fetches data and writes to S3 bucket, and a daily
+    schedule that closes the previous day's rollups.
     
     Args:
         data_bucket: S3 Bucket instance where Lambda will write data
+        enable_iceberg: Write curated data to the Glue Iceberg table instead of Parquet files
+        typed_output: Write timestamps, narrowed integers and float coordinates
     """
 
-    def __init__(self, scope: Construct, construct_id: str, data_bucket: s3.Bucket, **kwargs) -> None:
+    def __init__(self, scope: Construct, construct_id: str, data_bucket: s3.Bucket, enable_iceberg: bool = False, typed_output: bool = False, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
         # Validate input
@@ -42,6 +47,12 @@ class MpsIngestionStack(Stack):
             ],
         )
 
+        # pyiceberg and its dependencies are bundled only with the optional Iceberg sink,
+        # the default bundle is already close to the 250 MB unzipped limit
+        requirements = "-r requirements.txt"
+        if enable_iceberg:
+            requirements += " -r requirements-iceberg.txt"
+
         # Create Lambda function for data fetching
         self.data_fetcher_lambda = _lambda.Function(
             self,
@@ -55,7 +66,7 @@ class MpsIngestionStack(Stack):
                     "command": [
                         "bash",
                         "-c",
-                        "pip install -r requirements.txt -t /asset-output && cp -r . /asset-output",
+                        f"pip install {requirements} -t /asset-output && cp -r . /asset-output",
                     ],
                 },
             ),
@@ -67,6 +78,13 @@ class MpsIngestionStack(Stack):
                 "LOG_LEVEL": "INFO",
                 "BUCKET_NAME": self.data_bucket.bucket_name,
                 "BUCKET_ARN": self.data_bucket.bucket_arn,
+                "FILEPATH_BASE_STORAGE": "raw/users",
+                "FILEPATH_RAW_STORAGE": "raw_json/users",
+                "FILEPATH_QUARANTINE_STORAGE": "quarantine/users",
+                "FILEPATH_ROLLUPS_STORAGE": "rollups",
+                "FILEPATH_PROFILES_STORAGE": "profiles",
+                "FILEPATH_MANIFEST_STORAGE": "manifests/users",
+                "TYPED_OUTPUT": str(typed_output).lower(),
             },
             log_retention=logs.RetentionDays.ONE_WEEK,
         )
@@ -74,6 +92,57 @@ class MpsIngestionStack(Stack):
         # Grant Lambda write permissions to the bucket
         self.data_bucket.grant_write(self.data_fetcher_lambda.role)
 
+        # Grant Lambda read permissions on raw payloads for replay mode
+        self.data_bucket.grant_read(self.data_fetcher_lambda.role, "raw_json/*")
+
+        # Grant Lambda read permissions on rollups, merged when a day is closed
+        self.data_bucket.grant_read(self.data_fetcher_lambda.role, "rollups/*")
+
+        # Close the previous day's rollups once no batch can still write to it
+        # (batches are stamped with their start time and time out after 30 seconds)
+        self.close_rollups_rule = events.Rule(
+            self,
+            id="MPS-CloseRollupsSchedule",
+            description="Merge the previous day's rollup files into one file per rollup",
+            schedule=events.Schedule.cron(minute="15", hour="0"),
+            targets=[
+                targets.LambdaFunction(
+                    self.data_fetcher_lambda,
+                    event=events.RuleTargetInput.from_object({"mode": "close_rollups"}),
+                )
+            ],
+        )
+
+        # Configure the Iceberg sink (table created by the catalog stack)
+        if enable_iceberg:
+            iceberg_environment = {
+                "OUTPUT_FORMAT": "iceberg",
+                "ICEBERG_CATALOG_TYPE": "glue",
+                "ICEBERG_WAREHOUSE": f"s3://{self.data_bucket.bucket_name}/iceberg",
+                "ICEBERG_NAMESPACE": "mps-data-db",
+                "ICEBERG_TABLE": "mps_users_iceberg",
+            }
+            for key, value in iceberg_environment.items():
+                self.data_fetcher_lambda.add_environment(key, value)
+
+            # Iceberg commits read the current metadata before writing a new one
+            self.data_bucket.grant_read(self.data_fetcher_lambda.role, "iceberg/*")
+            self.data_fetcher_lambda.add_to_role_policy(
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=[
+                        "glue:GetDatabase",
+                        "glue:GetTable",
+                        "glue:UpdateTable",
+                    ],
+                    resources=[
+                        f"arn:aws:glue:{self.region}:{self.account}:catalog",
+                        f"arn:aws:glue:{self.region}:{self.account}:database/mps-data-db",
+                        f"arn:aws:glue:{self.region}:{self.account}:table/mps-data-db/mps_users_iceberg",
+                    ]
+                )
+            )
+
         # Export outputs
         CfnOutput(
             self, "DataFetcherLambdaNameOutput",
@@ -7,6 +7,7 @@ from .mps_ingestion_stack import MpsIngestionStack
 from .mps_storage_stack import StorageStack
 from .mps_catalog_stack import CatalogStack
 from .mps_permissions_stack import PermissionsStack
+from decouple import config
 
 class MpsProjectStack(Stack):
     """
@@ -26,6 +27,13 @@ class MpsProjectStack(Stack):
             "catalog":"MPS-CatalogStack",
             "permissions":"MPS-PermissionsStack",
         }
+
+        # Optional Apache Iceberg table for the users dataset
+        enable_iceberg = config("ENABLE_ICEBERG", default=False, cast=bool)
+
+        # Compact physical types in the curated output (timestamps, narrowed integers).
+        # Before switching it on, rewrite history with `reprocess.py --typed` (see CatalogStack)
+        typed_output = config("TYPED_OUTPUT", default=False, cast=bool)
         
         # Create data storage stack
         self.storage_stack = StorageStack(
@@ -41,6 +49,8 @@ class MpsProjectStack(Stack):
             construct_id=name_stacks["ingestion"],
             stack_name=name_stacks["ingestion"],
             data_bucket=self.storage_stack.data_bucket,
+            enable_iceberg=enable_iceberg,
+            typed_output=typed_output,
             description="MPS Project Stack - Ingestion Stack. Lambda Data Fetcher"
         )
 
@@ -58,6 +68,8 @@ class MpsProjectStack(Stack):
             construct_id=name_stacks["catalog"],
             stack_name=name_stacks["catalog"],
             data_bucket=self.storage_stack.data_bucket, 
+            enable_iceberg=enable_iceberg,
+            typed_output=typed_output,
             description="MPS Project Stack - Catalog Stack. Glue Data Catalog and Crawler"
         )
 
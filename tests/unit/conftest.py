@@ -0,0 +1,109 @@
+import datetime
+import io
+import os
+import sys
+
+import pytest
+
+# Lambda modules are flat in lambda/ and import each other by module name
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "lambda"))
+
+
+def build_user(i=0, age=None, street_number=None):
+    """
+    Build a Random User API record.
+
+    Args:
+        i: Index used to vary names, ages, street numbers and nationalities
+        age: Override for dob.age
+        street_number: Override for location.street.number
+
+    Returns:
+        Nested user record as returned in the API `results` array
+    """
+    return {
+        "gender": "female",
+        "name": {"title": "Ms", "first": f"First{i}", "last": "Last"},
+        "location": {
+            "street": {"number": 100 + i % 900 if street_number is None else street_number, "name": "Main Street"},
+            "city": "City",
+            "state": "State",
+            "country": "Country",
+            "postcode": 10000 + i % 90000,
+            "coordinates": {"latitude": "12.3456", "longitude": "-45.6789"},
+            "timezone": {"offset": "+1:00", "description": "Brussels, Copenhagen, Madrid, Paris"},
+        },
+        "email": f"first{i}.last@example.com",
+        "login": {
+            "uuid": f"00000000-0000-0000-0000-{i:012d}",
+            "username": f"user{i}",
+            "password": "secret",
+            "salt": "salt",
+            "md5": "md5",
+            "sha1": "sha1",
+            "sha256": "sha256",
+        },
+        "dob": {"date": "1980-05-01T10:00:00.000Z", "age": 18 + i % 70 if age is None else age},
+        "registered": {"date": "2015-03-02T11:00:00.000Z", "age": i % 20},
+        "phone": "555-0100",
+        "cell": "555-0101",
+        "id": {"name": "SSN", "value": f"{i}"},
+        "picture": {"large": "large.jpg", "medium": "medium.jpg", "thumbnail": "thumb.jpg"},
+        "nat": ["US", "GB", "FR", "DE", "ES"][i % 5],
+    }
+
+
+@pytest.fixture
+def make_user():
+    """Factory fixture for Random User API records (see build_user)."""
+    return build_user
+
+
+class FakeS3:
+    """In-memory stand-in for the subset of the boto3 S3 client used by the Lambda."""
+
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self):
+        self.objects = {}
+        self.last_modified = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[(Bucket, Key)] = Body
+        self.last_modified[(Bucket, Key)] = datetime.datetime.now(datetime.timezone.utc)
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)]), "LastModified": self.last_modified[(Bucket, Key)]}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+    def copy_object(self, Bucket, Key, CopySource):
+        self.put_object(Bucket, Key, self.objects[(CopySource["Bucket"], CopySource["Key"])])
+
+    def get_paginator(self, operation):
+        client = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix, StartAfter=""):
+                keys = [key for key in client.keys(Prefix) if key > StartAfter]
+                yield {"Contents": [{"Key": key} for key in keys]}
+
+        return Paginator()
+
+    def keys(self, prefix=""):
+        return sorted(key for _, key in self.objects if key.startswith(prefix))
+
+
+@pytest.fixture
+def fake_s3(monkeypatch):
+    """Replace the S3 client of data_fetcher with a FakeS3."""
+    import data_fetcher
+
+    client = FakeS3()
+    monkeypatch.setattr(data_fetcher, "s3", client)
+    return client
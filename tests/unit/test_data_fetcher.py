@@ -0,0 +1,146 @@
+import datetime
+import gzip
+import io
+import json
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import data_fetcher
+from data_fetcher import transform_users
+from lake_storage import S3Storage, to_parquet_bytes
+from rollups import update_rollups
+
+
+def test_typed_output_uses_compact_physical_types(make_user):
+    users = [make_user(age=34, street_number=9001), make_user(1, age=120, street_number=12)]
+    df, _ = transform_users(users, typed=True)
+
+    schema = pq.read_schema(io.BytesIO(to_parquet_bytes(df)))
+
+    assert schema.field("dob.date").type == pa.timestamp("ms", tz="UTC")
+    assert schema.field("registered.date").type == pa.timestamp("ms", tz="UTC")
+    assert schema.field("dob.age").type == pa.int8()
+    assert schema.field("location.street.number").type == pa.int16()
+    assert schema.field("location.coordinates.latitude").type == pa.float32()
+    assert schema.field("nat").type == pa.string()
+    assert schema.field("location.postcode").type == pa.string()
+
+
+def test_low_cardinality_strings_are_dictionary_encoded_by_the_writer(make_user):
+    df, _ = transform_users([make_user(i) for i in range(4)], typed=True)
+
+    metadata = pq.ParquetFile(io.BytesIO(to_parquet_bytes(df))).metadata
+    column = metadata.schema.names.index("nat")
+
+    assert "RLE_DICTIONARY" in metadata.row_group(0).column(column).encodings
+
+
+def test_default_output_is_unchanged(make_user):
+    df, _ = transform_users([make_user(age=34, street_number=9001)])
+
+    assert df["dob.date"].tolist() == ["1980-05-01T10:00:00.000Z"]
+    assert df["dob.age"].dtype == "int64"
+    assert df["nat"].dtype == "object"
+
+
+def test_postcodes_are_kept_as_strings(make_user):
+    users = [make_user(i) for i in range(2)]
+    users[1]["location"]["postcode"] = "EC1A 1BB"
+
+    df, quarantine_df = transform_users(users)
+    numeric_only, _ = transform_users(users[:1])
+
+    assert df["location.postcode"].tolist() == ["10000", "EC1A 1BB"]
+    assert numeric_only["location.postcode"].tolist() == ["10000"]
+    assert quarantine_df.empty
+
+
+class Context:
+    aws_request_id = "request-1"
+
+
+class Response:
+    def __init__(self, payload):
+        self.content = json.dumps(payload).encode("utf-8")
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return json.loads(self.content)
+
+
+@pytest.fixture
+def lambda_env(monkeypatch):
+    monkeypatch.setenv("BUCKET_NAME", "bucket")
+    monkeypatch.setenv("FILEPATH_BASE_STORAGE", "raw/users")
+    monkeypatch.setenv("API_URL", "https://randomuser.me/api/")
+    monkeypatch.setenv("REQUESTS_TIMEOUT", "5")
+
+
+def test_raw_payload_is_stored_and_replayed_without_http(lambda_env, fake_s3, make_user, monkeypatch):
+    payload = {"results": [make_user(i) for i in range(3)], "info": {"results": 3}}
+    monkeypatch.setattr(data_fetcher.requests, "get", lambda *args, **kwargs: Response(payload))
+
+    body = json.loads(data_fetcher.handler({}, Context())["body"])
+
+    raw_key = body["raw_path"].split("/", 3)[-1]
+    parquet_key = body["s3_path"].split("/", 3)[-1]
+    assert raw_key.startswith("raw_json/users/year=") and raw_key.endswith("/request-1.json.gz")
+    assert data_fetcher.raw_key_to_partition_key(raw_key, "raw_json/users", "raw/users") == parquet_key
+    assert json.loads(gzip.decompress(fake_s3.objects[("bucket", raw_key)])) == payload
+
+    original = fake_s3.objects.pop(("bucket", parquet_key))
+
+    def no_http(*args, **kwargs):
+        raise AssertionError("replay must not call the API")
+
+    monkeypatch.setattr(data_fetcher.requests, "get", no_http)
+    replayed = json.loads(data_fetcher.handler({"mode": "replay", "raw_keys": [raw_key]}, Context())["body"])
+
+    assert replayed["replayed"][0]["s3_path"] == body["s3_path"]
+    assert fake_s3.objects[("bucket", parquet_key)] == original
+
+
+def test_replay_commits_to_iceberg_once_per_batch(lambda_env, fake_s3, make_user, monkeypatch, tmp_path):
+    pytest.importorskip("pyiceberg")
+    import iceberg_sink
+
+    monkeypatch.setenv("OUTPUT_FORMAT", "iceberg")
+    monkeypatch.setenv("ICEBERG_CATALOG_TYPE", "sql")
+    monkeypatch.setenv("ICEBERG_CATALOG_URI", f"sqlite:///{tmp_path}/catalog.db")
+    monkeypatch.setenv("ICEBERG_WAREHOUSE", f"file://{tmp_path}/warehouse")
+    monkeypatch.setattr(data_fetcher.requests, "get", lambda *args, **kwargs: Response({"results": [make_user()]}))
+
+    body = json.loads(data_fetcher.handler({}, Context())["body"])
+    raw_key = body["raw_path"].split("/", 3)[-1]
+    # Stored by an invocation whose Iceberg commit failed
+    lost_key = raw_key.replace("request-1", "request-2")
+    data_fetcher.save_raw_payload(json.dumps({"results": [make_user(1), make_user(2)]}).encode(), "bucket", lost_key)
+
+    replayed = json.loads(data_fetcher.handler({"mode": "replay", "raw_keys": [raw_key, lost_key]}, Context())["body"])
+
+    assert [r["iceberg_snapshot_id"] is None for r in replayed["replayed"]] == [True, False]
+    assert fake_s3.keys("raw/users") == []
+    table = iceberg_sink.get_catalog().load_table(iceberg_sink.table_identifier())
+    assert sorted(table.scan().to_arrow()[iceberg_sink.BATCH_ID_COLUMN].to_pylist()) == \
+        ["request-1", "request-2", "request-2"]
+
+
+def test_close_rollups_mode_merges_the_previous_day(lambda_env, fake_s3, make_user):
+    yesterday = datetime.datetime.now(datetime.timezone.utc).date() - datetime.timedelta(days=1)
+    curated, _ = transform_users([make_user(i) for i in range(4)])
+    storage = S3Storage("bucket", client=fake_s3)
+    update_rollups(curated[:2], storage, "rollups", yesterday, "request-1")
+    update_rollups(curated[2:], storage, "rollups", yesterday, "request-2")
+
+    body = json.loads(data_fetcher.handler({"mode": "close_rollups"}, Context())["body"])
+
+    assert body == {"message": "Rollups closed successfully.", "day": yesterday.isoformat(), "merged_files": 4}
+    assert [key.rsplit("/", 1)[-1] for key in fake_s3.keys("rollups/")] == ["day.parquet", "day.parquet"]
+
+    with pytest.raises(Exception, match="not finished"):
+        today = yesterday + datetime.timedelta(days=1)
+        data_fetcher.handler({"mode": "close_rollups", "day": today.isoformat()}, Context())
@@ -0,0 +1,57 @@
+import time
+
+import pytest
+
+from data_fetcher import cast_columns, normalize_users
+from data_quality import REASONS_COLUMN, validate_users
+
+
+def test_valid_users_pass(make_user):
+    df = normalize_users([make_user(i) for i in range(10)])
+
+    valid_df, quarantine_df = validate_users(df)
+
+    assert len(valid_df) == 10
+    assert quarantine_df.empty
+
+
+def test_failing_users_are_quarantined_with_reasons(make_user):
+    users = [make_user(i) for i in range(5)]
+    users[0]["email"] = "not-an-email"
+    users[1]["dob"]["age"] = "abc"
+    users[1]["nat"] = "ZZ"
+    users[2]["registered"]["age"] = -1
+    del users[3]["login"]["uuid"]
+
+    valid_df, quarantine_df = validate_users(normalize_users(users))
+
+    assert len(valid_df) == 1
+    assert quarantine_df[REASONS_COLUMN].tolist() == [
+        "invalid_email",
+        "invalid_dob_age;invalid_nat",
+        "invalid_registered_age",
+        "missing_login_uuid",
+    ]
+    # Original values are kept for inspection instead of being coerced
+    assert quarantine_df.loc[1, "dob.age"] == "abc"
+
+
+@pytest.mark.benchmark
+def test_validation_overhead_is_small_fraction_of_transform(make_user):
+    users = [make_user(i) for i in range(20000)]
+
+    def best_of(func, repeat=3):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    df = normalize_users(users)
+    transform_time = best_of(lambda: cast_columns(normalize_users(users)))
+    validation_time = best_of(lambda: validate_users(df))
+
+    assert validation_time < 0.2 * transform_time, (
+        f"validation took {validation_time:.3f}s vs transform {transform_time:.3f}s"
+    )
@@ -0,0 +1,94 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyiceberg")
+
+from pyiceberg.catalog.sql import SqlCatalog
+from pyiceberg.schema import Schema
+from pyiceberg.types import FloatType, IntegerType, LongType, NestedField, StringType, TimestampType
+
+from data_fetcher import transform_users
+from iceberg_sink import BATCH_ID_COLUMN, INGESTED_AT_COLUMN, write_users
+
+IDENTIFIER = ("mps", "users")
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    return SqlCatalog(
+        "test",
+        uri=f"sqlite:///{tmp_path}/catalog.db",
+        warehouse=f"file://{tmp_path}/warehouse",
+    )
+
+
+def make_batch(start, size):
+    return pd.DataFrame({
+        "email": [f"user{i}@example.com" for i in range(start, start + size)],
+        "nat": ["US"] * size,
+        "dob.age": list(range(start, start + size)),
+    })
+
+
+def test_each_batch_is_a_snapshot_with_column_bounds(catalog):
+    day = datetime.datetime(2026, 10, 1, tzinfo=datetime.timezone.utc)
+    first = write_users(make_batch(0, 3), day, catalog=catalog, identifier=IDENTIFIER)
+    second = write_users(make_batch(3, 2), day + datetime.timedelta(days=1), catalog=catalog, identifier=IDENTIFIER)
+
+    table = catalog.load_table(IDENTIFIER)
+    assert [s.snapshot_id for s in table.metadata.snapshots] == [first, second]
+    assert "dob_age" in table.schema().column_names
+
+    # Manifest bounds prune the first file for a filter on the second day
+    scan = table.scan(row_filter=f"{INGESTED_AT_COLUMN} >= '2026-10-02T00:00:00'")
+    assert len(list(scan.plan_files())) == 1
+    assert scan.to_arrow().num_rows == 2
+
+
+def test_batch_is_committed_once(catalog):
+    day = datetime.datetime(2026, 10, 1, tzinfo=datetime.timezone.utc)
+    first = write_users(make_batch(0, 3), day, catalog=catalog, identifier=IDENTIFIER, batch_id="request-1")
+    retried = write_users(make_batch(0, 3), day, catalog=catalog, identifier=IDENTIFIER, batch_id="request-1")
+    other = write_users(make_batch(3, 2), day, catalog=catalog, identifier=IDENTIFIER, batch_id="request-2")
+
+    table = catalog.load_table(IDENTIFIER)
+    assert retried is None
+    assert [s.snapshot_id for s in table.metadata.snapshots] == [first, other]
+    assert sorted(table.scan().to_arrow()[BATCH_ID_COLUMN].to_pylist()) == ["request-1"] * 3 + ["request-2"] * 2
+
+
+# Glue column types of CatalogStack -> Iceberg types
+GLUE_TO_ICEBERG = {
+    "string": StringType(),
+    "bigint": LongType(),
+    "int": IntegerType(),
+    "float": FloatType(),
+    "timestamp": TimestampType(),
+}
+
+
+@pytest.mark.parametrize("typed", [False, True])
+def test_batches_fit_the_table_declared_by_the_catalog_stack(catalog, make_user, typed):
+    catalog_stack = pytest.importorskip("mps_project.mps_catalog_stack")
+    columns = [
+        (name, catalog_stack.ICEBERG_TYPED_COLUMN_TYPES.get(name, column_type) if typed else column_type)
+        for name, column_type in catalog_stack.ICEBERG_USERS_COLUMNS
+    ]
+    # Declared without its last column, so the first batch also adds a column to the table
+    catalog.create_namespace(IDENTIFIER[0])
+    catalog.create_table(IDENTIFIER, schema=Schema(*[
+        NestedField(field_id, name, GLUE_TO_ICEBERG[column_type], required=False)
+        for field_id, (name, column_type) in enumerate(columns[:-1], start=1)
+    ]))
+
+    df, _ = transform_users([make_user(i) for i in range(3)], typed=typed)
+    ingested_at = datetime.datetime(2026, 10, 1, 12, tzinfo=datetime.timezone.utc)
+    write_users(df, ingested_at, catalog=catalog, identifier=IDENTIFIER, batch_id="request-1")
+
+    table = catalog.load_table(IDENTIFIER)
+    assert [(field.name, str(field.field_type)) for field in table.schema().fields] == \
+        [(name, str(GLUE_TO_ICEBERG[column_type])) for name, column_type in columns]
+    rows = table.scan().to_arrow()
+    assert rows[INGESTED_AT_COLUMN].to_pylist() == [datetime.datetime(2026, 10, 1, 12)] * 3
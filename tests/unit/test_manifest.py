@@ -0,0 +1,65 @@
+import datetime
+import json
+
+from data_fetcher import transform_users
+from lake_storage import LocalStorage, to_parquet_bytes
+from manifest import append_entry, build_entry, files_added_since
+
+MANIFEST_PREFIX = "manifests/users"
+UTC = datetime.timezone.utc
+LAG = datetime.timedelta(minutes=5)
+
+
+def test_entry_describes_file(tmp_path, make_user):
+    users = [make_user(age=34, street_number=9001), make_user(5, age=61, street_number=12)]
+    df, _ = transform_users(users, typed=True)
+    body = to_parquet_bytes(df)
+    added_at = datetime.datetime(2026, 1, 2, 3, 4, 5, tzinfo=UTC)
+
+    key = append_entry(LocalStorage(tmp_path), MANIFEST_PREFIX, build_entry("run.parquet", body, df), "run", added_at)
+    entry = json.loads((tmp_path / key).read_text())
+
+    assert entry["rows"] == 2
+    assert entry["bytes"] == len(body)
+    assert entry["added_at"] == "2026-01-02T03:04:05+00:00"
+    assert entry["columns"]["dob.age"] == {"min": 34, "max": 61}
+    assert entry["columns"]["nat"] == {"min": "US", "max": "US"}
+
+    untyped_df, _ = transform_users([make_user(age=34, street_number=9001)])
+    assert build_entry("k", to_parquet_bytes(untyped_df), untyped_df)["schema_fingerprint"] != \
+        entry["schema_fingerprint"]
+
+
+def test_files_added_since_watermark(tmp_path, make_user):
+    df, _ = transform_users([make_user(age=30, street_number=10)])
+    entry = build_entry("a.parquet", to_parquet_bytes(df), df)
+    storage = LocalStorage(tmp_path)
+    first = datetime.datetime(2026, 1, 1, 23, 59, tzinfo=UTC)
+    second = datetime.datetime(2026, 1, 2, 0, 1, tzinfo=UTC)
+    append_entry(storage, MANIFEST_PREFIX, entry, "a", first)
+    append_entry(storage, MANIFEST_PREFIX, {**entry, "key": "b.parquet"}, "b", second)
+
+    entries, watermark = files_added_since(storage, MANIFEST_PREFIX, now=second + LAG)
+    assert [entry["key"] for entry in entries] == ["a.parquet", "b.parquet"]
+    assert watermark == second
+
+    entries, watermark = files_added_since(storage, MANIFEST_PREFIX, watermark=watermark, now=second + 2 * LAG)
+    assert entries == []
+    assert watermark == second + LAG
+
+
+def test_entry_committed_out_of_order_is_not_skipped(tmp_path, make_user):
+    df, _ = transform_users([make_user()])
+    entry = build_entry("x.parquet", to_parquet_bytes(df), df)
+    storage = LocalStorage(tmp_path)
+    stamp_a = datetime.datetime(2026, 1, 2, 12, 0, 0, tzinfo=UTC)
+    stamp_b = stamp_a + datetime.timedelta(seconds=2)
+
+    # Writer B stamps after writer A but commits first; a consumer reads in between
+    append_entry(storage, MANIFEST_PREFIX, {**entry, "key": "b.parquet"}, "b", stamp_b)
+    entries, watermark = files_added_since(storage, MANIFEST_PREFIX, now=stamp_b + datetime.timedelta(seconds=1))
+    assert entries == []
+
+    append_entry(storage, MANIFEST_PREFIX, {**entry, "key": "a.parquet"}, "a", stamp_a)
+    entries, _ = files_added_since(storage, MANIFEST_PREFIX, watermark=watermark, now=stamp_b + LAG)
+    assert [entry["key"] for entry in entries] == ["a.parquet", "b.parquet"]
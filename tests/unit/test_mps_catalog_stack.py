@@ -0,0 +1,32 @@
+import aws_cdk as core
+import aws_cdk.assertions as assertions
+from aws_cdk import aws_s3 as s3
+
+from mps_project.mps_catalog_stack import CatalogStack
+
+
+def catalog_template(**kwargs):
+    app = core.App()
+    bucket = s3.Bucket(core.Stack(app, "storage"), "data")
+    return assertions.Template.from_stack(CatalogStack(app, "catalog", data_bucket=bucket, **kwargs))
+
+
+def test_iceberg_table_is_maintained_by_glue_optimizers():
+    template = catalog_template(enable_iceberg=True)
+
+    for optimizer_type in ("compaction", "retention", "orphan_file_deletion"):
+        template.has_resource_properties("AWS::Glue::TableOptimizer", {
+            "TableName": "mps_users_iceberg",
+            "Type": optimizer_type,
+            "TableOptimizerConfiguration": assertions.Match.object_like({"Enabled": True}),
+        })
+    template.has_resource_properties("AWS::Glue::TableOptimizer", {
+        "Type": "retention",
+        "TableOptimizerConfiguration": assertions.Match.object_like({
+            "RetentionConfiguration": {"IcebergConfiguration": assertions.Match.object_like({"CleanExpiredFiles": True})},
+        }),
+    })
+
+
+def test_no_optimizers_without_iceberg():
+    catalog_template().resource_count_is("AWS::Glue::TableOptimizer", 0)
@@ -0,0 +1,41 @@
+import pstats
+
+import pytest
+
+from profiling import run_profiled
+
+
+class Context:
+    aws_request_id = "request-1"
+
+
+def allocate(event, context):
+    blocks = [bytearray(1024) for _ in range(100)]
+    return {"statusCode": 200, "blocks": len(blocks)}
+
+
+def fail(event, context):
+    raise RuntimeError("boom")
+
+
+def test_artifacts_written_to_local_directory(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROFILE_OUTPUT_DIR", str(tmp_path))
+
+    result = run_profiled(allocate, {}, Context(), s3_client=None)
+
+    assert result == {"statusCode": 200, "blocks": 100}
+    stats = pstats.Stats(str(tmp_path / "request-1.cpu.prof"))
+    assert any(name == "allocate" for _, _, name in stats.stats)
+    assert "allocate" in (tmp_path / "request-1.cpu.txt").read_text()
+    memory = (tmp_path / "request-1.memory.txt").read_text()
+    assert memory.startswith("Peak traced memory:")
+    assert "test_profiling.py" in memory
+
+
+def test_artifacts_written_when_handler_fails(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROFILE_OUTPUT_DIR", str(tmp_path))
+
+    with pytest.raises(RuntimeError):
+        run_profiled(fail, {}, Context(), s3_client=None)
+
+    assert (tmp_path / "request-1.cpu.prof").exists()
@@ -0,0 +1,154 @@
+import datetime
+import gzip
+import io
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from data_fetcher import transform_users
+from lake_storage import LocalStorage, S3Storage, to_parquet_bytes
+from manifest import files_added_since
+from reprocess import rebuild_partition, reprocess
+
+DAY = datetime.date(2026, 1, 2)
+PARTITION = "year=2026/month=01/day=02"
+PREFIXES = {
+    "raw_prefix": "raw_json/users",
+    "filepath_base_storage": "raw/users",
+    "quarantine_prefix": "quarantine/users",
+    "manifest_prefix": "manifests/users",
+}
+
+
+def put(root, key, body):
+    path = root / key
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(body)
+
+
+def read_parquet(storage, key):
+    return pd.read_parquet(io.BytesIO(storage.read(key)))
+
+
+def test_rebuild_picks_source_per_file_and_keeps_every_file(tmp_path, make_user):
+    # Written before raw payloads were kept, with the postcode coerced to int64
+    legacy = pd.json_normalize([make_user(5)])
+    put(tmp_path, f"raw/users/{PARTITION}/old-run.parquet", to_parquet_bytes(legacy))
+
+    # Written with raw payload; its Parquet file is stale and gets rebuilt from raw
+    users = [make_user(i) for i in range(3)]
+    users[2]["nat"] = "ZZ"
+    put(tmp_path, f"raw_json/users/{PARTITION}/new-run.json.gz", gzip.compress(json.dumps({"results": users}).encode()))
+    put(tmp_path, f"raw/users/{PARTITION}/new-run.parquet", to_parquet_bytes(legacy))
+
+    # Committed to Iceberg: raw payload but no curated file
+    put(tmp_path, f"raw_json/users/{PARTITION}/iceberg-run.json.gz", gzip.compress(b'{"results": []}'))
+
+    storage = LocalStorage(tmp_path)
+    result = rebuild_partition(storage, DAY, **PREFIXES)
+
+    assert result["raw_files"] == 1 and result["parquet_files"] == 1 and result["skipped_raw"] == 1
+    assert storage.list_keys("raw/users") == [
+        f"raw/users/{PARTITION}/new-run.parquet",
+        f"raw/users/{PARTITION}/old-run.parquet",
+    ]
+    assert storage.list_keys("quarantine/users") == [f"quarantine/users/{PARTITION}/new-run.jsonl.gz"]
+
+    entries, _ = files_added_since(storage, "manifests/users", now=datetime.datetime.max.replace(tzinfo=datetime.timezone.utc))
+    assert sorted((entry["key"][-15:], entry["rows"]) for entry in entries) == [
+        ("new-run.parquet", 2),
+        ("old-run.parquet", 1),
+    ]
+
+    expected, _ = transform_users(users)
+    pd.testing.assert_frame_equal(read_parquet(storage, f"raw/users/{PARTITION}/new-run.parquet"), expected)
+    assert read_parquet(storage, f"raw/users/{PARTITION}/old-run.parquet")["location.postcode"].tolist() == ["10005"]
+
+
+def test_reprocess_rebuilds_partitions_in_parallel(tmp_path, make_user):
+    for day in ("01", "02"):
+        payload = {"results": [make_user(i) for i in range(2)]}
+        put(tmp_path, f"raw_json/users/year=2026/month=01/day={day}/run.json.gz", gzip.compress(json.dumps(payload).encode()))
+        put(tmp_path, f"raw/users/year=2026/month=01/day={day}/run.parquet", b"stale")
+
+    results = reprocess(
+        LocalStorage(tmp_path), datetime.date(2026, 1, 1), datetime.date(2026, 1, 3), typed=True, max_workers=2, **PREFIXES
+    )
+
+    assert [r["partition"][-6:] for r in results] == ["day=01", "day=02"]
+    assert all(r["raw_files"] == 1 and r["rows"] == 2 for r in results)
+
+
+def test_local_swap_switches_versions_and_keeps_untouched_files(tmp_path):
+    storage = LocalStorage(tmp_path)
+    prefix = f"raw/users/{PARTITION}"
+    put(tmp_path, f"{prefix}/a.parquet", b"a1")
+    put(tmp_path, f"{prefix}/b.parquet", b"b1")
+    put(tmp_path, f"{prefix}/c.parquet", b"c1")
+
+    storage.swap_partition(prefix, {f"{prefix}/a.parquet": b"a2"}, delete_keys={f"{prefix}/c.parquet"})
+    first_version = os.path.realpath(tmp_path / prefix)
+    storage.swap_partition(prefix, {f"{prefix}/d.parquet": b"d1"})
+
+    assert os.path.islink(tmp_path / prefix)
+    assert not os.path.exists(first_version)
+    assert storage.list_keys("raw/users") == [f"{prefix}/a.parquet", f"{prefix}/b.parquet", f"{prefix}/d.parquet"]
+    assert [storage.read(key) for key in storage.list_keys(prefix)] == [b"a2", b"b1", b"d1"]
+    # Only the live version remains next to the partition
+    assert len(os.listdir(tmp_path / "raw/users/year=2026/month=01")) == 2
+
+
+class FakeGlue:
+    """In-memory stand-in for the Glue partition calls of S3Storage."""
+
+    class exceptions:
+        class EntityNotFoundException(Exception):
+            pass
+
+    def __init__(self):
+        self.partitions = {}
+        self.updates = 0
+
+    def get_partition(self, DatabaseName, TableName, PartitionValues):
+        if tuple(PartitionValues) not in self.partitions:
+            raise self.exceptions.EntityNotFoundException(PartitionValues)
+        return {"Partition": self.partitions[tuple(PartitionValues)]}
+
+    def update_partition(self, DatabaseName, TableName, PartitionValueList, PartitionInput):
+        self.partitions[tuple(PartitionValueList)] = PartitionInput
+        self.updates += 1
+
+
+def test_s3_swap_switches_glue_partition_to_new_version(fake_s3, make_user):
+    glue = FakeGlue()
+    prefix = f"raw/users/{PARTITION}"
+    glue.partitions[("2026", "01", "02")] = {
+        "Values": ["2026", "01", "02"],
+        "StorageDescriptor": {"Location": f"s3://bucket/{prefix}/", "Columns": []},
+    }
+    df, _ = transform_users([make_user(i) for i in range(2)])
+    for name in ("a", "b"):
+        fake_s3.put_object("bucket", f"{prefix}/{name}.parquet", to_parquet_bytes(df))
+    storage = S3Storage("bucket", client=fake_s3, glue_tables={"raw/users": ("db", "mps_users")}, glue_client=glue)
+
+    storage.swap_partition(prefix, {f"{prefix}/a.parquet": b"a2"})
+
+    location = glue.partitions[("2026", "01", "02")]["StorageDescriptor"]["Location"]
+    version = location[len(f"s3://bucket/{prefix}/"):-1]
+    assert version.startswith("_v=") and glue.updates == 1
+    # The previous version is gone; the new one holds every file of the partition
+    assert fake_s3.keys("raw/users") == [f"{prefix}/{version}/a.parquet", f"{prefix}/{version}/b.parquet"]
+    assert storage.list_keys("raw/users") == [f"{prefix}/a.parquet", f"{prefix}/b.parquet"]
+    assert storage.read(f"{prefix}/a.parquet") == b"a2"
+
+    storage.swap_partition(prefix, {f"{prefix}/c.parquet": b"c1"}, delete_keys={f"{prefix}/a.parquet"})
+    assert storage.list_keys(prefix) == [f"{prefix}/b.parquet", f"{prefix}/c.parquet"]
+    assert not any(key.startswith(f"{prefix}/{version}/") for key in fake_s3.keys("raw/users"))
+
+
+def test_reprocess_refuses_unfinished_days(tmp_path):
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    with pytest.raises(ValueError, match="not a finished day"):
+        reprocess(LocalStorage(tmp_path), today, today, **PREFIXES)
@@ -0,0 +1,118 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+from lake_storage import LocalStorage, to_parquet_bytes
+from rollups import (
+    CLOSED_DAY_BATCH_ID,
+    ROLLUPS,
+    aggregate,
+    close_day,
+    close_days,
+    merge,
+    read_rollup,
+    rebuild,
+    update_rollups,
+)
+
+DAY = datetime.date(2026, 1, 2)
+
+
+def make_curated(ages, nats):
+    size = len(ages)
+    return pd.DataFrame({
+        "gender": ["female", "male"] * (size // 2) + ["female"] * (size % 2),
+        "nat": nats,
+        "dob.age": ages,
+        "dob.date": ["1980-05-01T10:00:00.000Z"] * size,
+        "registered.age": [3] * size,
+        "registered.date": ["2015-03-02T11:00:00.000Z"] * (size - 1) + ["2021-07-09T08:00:00.000Z"],
+    })
+
+
+def test_aggregate_buckets_and_cohorts():
+    rollups = aggregate(make_curated([17, 18, 40, 70], ["US", "US", "FR", "FR"]))
+
+    demographics = rollups["users_daily_demographics"]
+    assert sorted(demographics["age_bucket"]) == ["18-24", "35-44", "65+", "<18"]
+    assert demographics["users"].sum() == 4
+
+    cohorts = rollups["users_daily_cohorts"].set_index(ROLLUPS["users_daily_cohorts"])
+    assert cohorts.loc[("FR", "male", "2021"), "dob_age_sum"] == 70
+
+
+def test_incremental_merge_matches_full_aggregation():
+    first = make_curated([20, 30, 40], ["US", "GB", "US"])
+    second = make_curated([25, 35, 45, 55], ["US", "US", "GB", "DE"])
+
+    full = aggregate(pd.concat([first, second], ignore_index=True))
+    partial_first, partial_second = aggregate(first), aggregate(second)
+
+    for name, dimensions in ROLLUPS.items():
+        merged = merge(merge(None, partial_first[name], dimensions), partial_second[name], dimensions)
+        expected = full[name].sort_values(dimensions, ignore_index=True)
+        pd.testing.assert_frame_equal(merged, expected)
+
+
+def test_batches_write_own_files_and_retries_are_idempotent(tmp_path):
+    storage = LocalStorage(tmp_path)
+    first = make_curated([20, 30, 40], ["US", "GB", "US"])
+    second = make_curated([25, 35], ["US", "DE"])
+
+    update_rollups(first, storage, "rollups", DAY, "request-1")
+    update_rollups(second, storage, "rollups", DAY, "request-2")
+    # Retried invocation of the first batch
+    update_rollups(first, storage, "rollups", DAY, "request-1")
+
+    full = aggregate(pd.concat([first, second], ignore_index=True))
+    for name, dimensions in ROLLUPS.items():
+        expected = full[name].sort_values(dimensions, ignore_index=True)
+        pd.testing.assert_frame_equal(read_rollup(storage, "rollups", name, DAY), expected)
+
+
+def test_close_day_merges_deltas_into_one_file(tmp_path):
+    storage = LocalStorage(tmp_path)
+    first = make_curated([20, 30, 40], ["US", "GB", "US"])
+    second = make_curated([25, 35], ["US", "DE"])
+    update_rollups(first, storage, "rollups", DAY, "request-1")
+    update_rollups(second, storage, "rollups", DAY, "request-2")
+    before = {name: read_rollup(storage, "rollups", name, DAY) for name in ROLLUPS}
+
+    assert close_day(storage, "rollups", DAY) == 4
+    # Closing again is a no-op
+    assert close_day(storage, "rollups", DAY) == 0
+
+    for name in ROLLUPS:
+        assert storage.list_keys(f"rollups/{name}") == [
+            f"rollups/{name}/year=2026/month=01/day=02/{CLOSED_DAY_BATCH_ID}.parquet"
+        ]
+        pd.testing.assert_frame_equal(read_rollup(storage, "rollups", name, DAY), before[name])
+
+
+def test_close_days_refuses_the_current_day(tmp_path):
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    with pytest.raises(ValueError, match="not a finished day"):
+        close_days(LocalStorage(tmp_path), DAY, today, "rollups")
+
+
+def test_rebuild_writes_finished_days_as_one_file(tmp_path):
+    storage = LocalStorage(tmp_path)
+    partition = "year=2026/month=01/day=02"
+    for batch_id, curated in [
+        ("request-1", make_curated([20, 30], ["US", "GB"])),
+        ("request-2", make_curated([40], ["US"])),
+    ]:
+        path = tmp_path / f"raw/users/{partition}/{batch_id}.parquet"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(to_parquet_bytes(curated))
+
+    # Stale delta without a curated file
+    update_rollups(make_curated([50], ["DE"]), storage, "rollups", DAY, "request-3")
+
+    rebuild(storage, DAY, DAY, "raw/users", "rollups")
+
+    assert storage.list_keys("rollups/users_daily_demographics") == [
+        f"rollups/users_daily_demographics/{partition}/{CLOSED_DAY_BATCH_ID}.parquet"
+    ]
+    assert read_rollup(storage, "rollups", "users_daily_demographics", DAY)["users"].sum() == 3